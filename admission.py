@@ -0,0 +1,60 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is not admitted. reason is "queue_full" or "timeout".
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"Server is overloaded ({reason})")
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Caps concurrent model calls and bounds how many requests may wait for one.
+
+    Up to max_concurrent callers run at once. Up to max_queue more wait, each
+    for at most queue_timeout seconds. Anyone beyond that is rejected straight
+    away so clients can back off instead of piling onto an exhausted upstream.
+    """
+
+    def __init__(self, max_concurrent=8, max_queue=32, queue_timeout=10.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+
+    def check(self):
+        """
+        Reject immediately if a new caller would have nowhere to wait.
+        """
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise Overloaded("queue_full")
+
+    async def acquire(self):
+        self.check()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Overloaded("timeout") from None
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,651 @@
+import asyncio
+import base64
+import datetime
+import functools
+import importlib.util
+import json
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from logging_config import logger
+from schemas import BATCH_RESPONSE_SCHEMA, RESPONSE_SCHEMA
+
+
+def gemini_available():
+    """
+    Whether google-generativeai is installed, without paying for importing it.
+    """
+    try:
+        return importlib.util.find_spec("google.generativeai") is not None
+    except ImportError:
+        return False
+
+
+class UpstreamError(Exception):
+    """
+    Raised when a backend's upstream model call fails.
+    status_code is the upstream HTTP status when there is one.
+    """
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class InferenceBackend:
+    """
+    A model that turns a prompt, an image and the patient's symptoms into raw response text.
+
+    The text is parsed by the server exactly as Gemini output would be, so every
+    backend exercises the same parse and serialize path.
+
+    instruction is the prompt version's static instruction block, if it has one.
+    Backends that can cache it upstream send only the prompt and image with each
+    call; the rest send it ahead of the prompt (see with_instruction).
+
+    timeout is the seconds left for the call. Backends pass it to the upstream
+    request itself, so a call the server has given up on stops there too rather
+    than holding a connection or an executor thread until it finishes.
+
+    on_usage, when set, is called after each model call whose response reports
+    token usage, with a dict of prompt_tokens (including cached ones),
+    cached_tokens and output_tokens.
+    """
+
+    name = "base"
+    on_usage = None
+
+    async def generate(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        raise NotImplementedError
+
+    async def generate_stream(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        """
+        Yield the response text in chunks as it is generated.
+        Backends without streaming yield the whole response at once.
+        """
+        yield await self.generate(prompt, image_bytes, symptoms, mime_type, instruction, timeout)
+
+    async def generate_batch(self, prompt, images, symptoms_list, mime_type="image/jpeg", timeout=None):
+        """
+        Answer several cases in one model call and return the raw text of a JSON
+        array with one prediction per image, in order. The images follow the
+        prompt labelled "Case 1", "Case 2" and so on.
+        """
+        raise NotImplementedError
+
+    async def start(self):
+        """
+        Do any expensive setup (SDK imports, clients). Called from the server's
+        startup hook; backends also call it themselves on first use.
+        """
+
+    async def warm_up(self):
+        """
+        Make a cheap upstream call so connections and auth are primed before traffic arrives.
+        """
+
+    async def cache_instruction(self, instruction):
+        """
+        Create the upstream cached copy of an instruction block now rather than on first use.
+        """
+
+    def _record_usage(self, prompt_tokens, cached_tokens, output_tokens):
+        if self.on_usage is not None:
+            self.on_usage({"prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens, "output_tokens": output_tokens})
+
+    async def close(self):
+        pass
+
+
+def with_instruction(prompt, instruction):
+    """
+    The prompt with the instruction block in front, for calls that do not use a cached copy of it.
+    """
+    return f"{instruction}\n\n{prompt}" if instruction else prompt
+
+
+def error_status(error):
+    return getattr(error, "status_code", None) or getattr(error, "code", None)
+
+
+def cached_content_missing(error):
+    """
+    Whether a call failed because its cached content has expired or been deleted upstream.
+    """
+    return error_status(error) in (403, 404)
+
+
+class InstructionCache:
+    """
+    Upstream cached-content handles for static instruction blocks.
+
+    create(instruction) is a coroutine function that caches the block upstream
+    for ttl seconds and returns a handle for calls to use: a model bound to the
+    cached content, or its resource name. get() never waits on it: it returns
+    the current handle, or None so the caller sends the instruction inline, and
+    starts a refresh in the background once the handle is past 80% of its TTL
+    or missing. A failed create is retried after retry_after seconds; until
+    then calls go inline. A create refused as invalid (400), e.g. because the
+    block is under the model's minimum cacheable size, is never retried.
+    """
+
+    # Stop using a handle this long before the upstream entry expires.
+    EXPIRY_MARGIN = 30
+
+    def __init__(self, create, ttl, retry_after=300):
+        self.create = create
+        self.ttl = ttl
+        self.retry_after = retry_after
+        self._handles = {}
+        self._retry_at = {}
+        self._refreshing = {}
+
+    def get(self, instruction):
+        now = time.monotonic()
+        handle, refresh_at, expires_at = self._handles.get(instruction, (None, 0, 0))
+        if now >= refresh_at and instruction not in self._refreshing and now >= self._retry_at.get(instruction, 0):
+            self._refreshing[instruction] = asyncio.ensure_future(self.refresh(instruction))
+        return handle if now < expires_at else None
+
+    async def refresh(self, instruction):
+        try:
+            handle = await self.create(instruction)
+        except Exception as e:
+            if error_status(e) == 400:
+                # Retrying will not change the answer, so stop asking until restart.
+                self._retry_at[instruction] = math.inf
+                logger.warning("instruction caching refused, sending it inline from now on", extra={"error": str(e)})
+            else:
+                self._retry_at[instruction] = time.monotonic() + self.retry_after
+                logger.warning("instruction caching failed, sending it inline", extra={"error": str(e)})
+            return
+        finally:
+            self._refreshing.pop(instruction, None)
+        now = time.monotonic()
+        self._handles[instruction] = (handle, now + self.ttl * 0.8, now + self.ttl - self.EXPIRY_MARGIN)
+        logger.info("instruction cached upstream", extra={"ttl_seconds": self.ttl})
+
+    def drop(self, instruction):
+        self._handles.pop(instruction, None)
+
+
+def batch_parts(prompt, images, mime_type):
+    """
+    Content parts for a batched call: the prompt, then each image after its case label.
+    """
+    parts = [prompt]
+    for number, image_bytes in enumerate(images, 1):
+        parts.append(f"Case {number}:")
+        parts.append({"mime_type": mime_type, "data": image_bytes})
+    return parts
+
+
+def structured_output_enabled():
+    return os.getenv("GEMINI_STRUCTURED_OUTPUT", "1") != "0"
+
+
+def sdk_schema(schema, schema_proto):
+    """
+    Adapt a REST response schema for the SDK, which spells propertyOrdering as property_ordering.
+
+    Older SDK releases have no such field and reject unknown ones, so the
+    ordering is dropped there rather than failing every call.
+    """
+    schema = dict(schema)
+    ordering = schema.pop("propertyOrdering", None)
+    if ordering is not None and "property_ordering" in schema_proto.meta.fields:
+        schema["property_ordering"] = ordering
+    if "items" in schema:
+        schema["items"] = sdk_schema(schema["items"], schema_proto)
+    if "properties" in schema:
+        schema["properties"] = {name: sdk_schema(value, schema_proto) for name, value in schema["properties"].items()}
+    return schema
+
+
+class GeminiBackend(InferenceBackend):
+    """
+    Google Gemini through the google-generativeai SDK.
+
+    The SDK call is blocking, so it runs on a bounded thread pool instead of the
+    event loop. max_workers caps concurrent model calls.
+
+    Unless GEMINI_STRUCTURED_OUTPUT=0, the model is asked for JSON matching
+    RESPONSE_SCHEMA, so its output can be validated without string scraping.
+
+    Built from the environment, the SDK is only imported and the model only
+    created by start(), so importing the server stays fast and a missing API
+    key is reported by the readiness check instead of crashing the import.
+
+    Instruction blocks are stored upstream as cached content for cache_ttl
+    seconds (GEMINI_CACHE_TTL, 0 to disable) and calls go through a model bound
+    to the cache, so the block is billed at the cached-token rate. Stale cache
+    entries are left to expire upstream on their own.
+    """
+
+    name = "gemini"
+
+    def __init__(
+        self, model=None, max_workers=8, model_name="gemini-2.5-flash", api_key=None, structured_output=True,
+        cache_ttl=3600,
+    ):
+        self.model = model
+        self.model_name = model_name
+        self.api_key = api_key
+        self.structured_output = structured_output
+        self.max_workers = max_workers
+        self.cache_ttl = cache_ttl
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._start_lock = asyncio.Lock()
+        self._batch_config = None
+        self._genai = None
+        self._generation_config = None
+        # Only set up when start() creates the model, since caching needs the SDK module.
+        self.instructions = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_workers=int(os.getenv("GEMINI_MAX_WORKERS", "8")),
+            model_name=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
+            api_key=os.getenv("GEMINI_API_KEY"),
+            structured_output=structured_output_enabled(),
+            cache_ttl=int(os.getenv("GEMINI_CACHE_TTL", "3600")),
+        )
+
+    def _create_model(self):
+        if not self.api_key:
+            raise ValueError("GEMINI_API_KEY not set in environment variables.")
+        try:
+            import google.generativeai as genai
+        except ImportError:
+            raise ValueError("google-generativeai is not installed.") from None
+
+        genai.configure(api_key=self.api_key)
+        generation_config = None
+        if self.structured_output:
+            generation_config = genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=sdk_schema(RESPONSE_SCHEMA, genai.protos.Schema),
+            )
+            # Passed per call for generate_batch, which expects an array of predictions.
+            self._batch_config = genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=sdk_schema(BATCH_RESPONSE_SCHEMA, genai.protos.Schema),
+            )
+        self._genai = genai
+        self._generation_config = generation_config
+        return genai.GenerativeModel(self.model_name, generation_config=generation_config)
+
+    def _create_cached_model(self, instruction):
+        cache = self._genai.caching.CachedContent.create(
+            model=self.model_name,
+            system_instruction=instruction,
+            ttl=datetime.timedelta(seconds=self.cache_ttl),
+        )
+        # Cached content cannot hold a generation config, so the response schema still goes with each call.
+        return self._genai.GenerativeModel.from_cached_content(
+            cached_content=cache, generation_config=self._generation_config
+        )
+
+    async def _cache_model(self, instruction):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._create_cached_model, instruction)
+
+    async def start(self):
+        async with self._start_lock:
+            if self.model is None:
+                # The SDK import is slow, so it happens off the event loop.
+                loop = asyncio.get_running_loop()
+                self.model = await loop.run_in_executor(self.executor, self._create_model)
+                if self._genai is not None and self.cache_ttl > 0:
+                    self.instructions = InstructionCache(self._cache_model, self.cache_ttl)
+
+    async def warm_up(self):
+        await self.start()
+        # count_tokens goes through auth and opens the connection without paying for a generation.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.model.count_tokens, "ping")
+
+    async def cache_instruction(self, instruction):
+        await self.start()
+        if self.instructions is not None:
+            await self.instructions.refresh(instruction)
+
+    @staticmethod
+    def _call(method, timeout, **kwargs):
+        """
+        method bound to the SDK's per-request deadline, so the RPC is cut off when the server stops waiting.
+        """
+        if timeout is not None:
+            kwargs["request_options"] = {"timeout": timeout}
+        return functools.partial(method, **kwargs) if kwargs else method
+
+    def _cached_model(self, instruction):
+        if not instruction or self.instructions is None:
+            return None
+        return self.instructions.get(instruction)
+
+    def _record_usage_metadata(self, usage):
+        if usage is not None:
+            self._record_usage(
+                usage.prompt_token_count, usage.cached_content_token_count, usage.candidates_token_count
+            )
+
+    async def generate(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        image = {"mime_type": mime_type, "data": image_bytes}
+        response = None
+        cached_model = self._cached_model(instruction)
+        if cached_model is not None:
+            try:
+                response = await loop.run_in_executor(
+                    self.executor, self._call(cached_model.generate_content, timeout), [prompt, image]
+                )
+            except Exception as e:
+                if not cached_content_missing(e):
+                    raise
+                # Gone upstream before its TTL ran out; send the instruction inline and recreate it.
+                self.instructions.drop(instruction)
+        if response is None:
+            generate = self._call(self.model.generate_content, timeout)
+            response = await loop.run_in_executor(self.executor, generate, [with_instruction(prompt, instruction), image])
+        self._record_usage_metadata(getattr(response, "usage_metadata", None))
+        return response.text
+
+    async def generate_batch(self, prompt, images, symptoms_list, mime_type="image/jpeg", timeout=None):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        if self._batch_config is not None:
+            generate = self._call(self.model.generate_content, timeout, generation_config=self._batch_config)
+        else:
+            generate = self._call(self.model.generate_content, timeout)
+        response = await loop.run_in_executor(self.executor, generate, batch_parts(prompt, images, mime_type))
+        self._record_usage_metadata(getattr(response, "usage_metadata", None))
+        return response.text
+
+    async def generate_stream(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        # The SDK's stream is a blocking iterator, so it is drained on the executor
+        # and the chunks are handed back to the event loop through a queue.
+        await self.start()
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+        image = {"mime_type": mime_type, "data": image_bytes}
+        cached_model = self._cached_model(instruction)
+
+        def produce():
+            try:
+                stream = None
+                if cached_model is not None:
+                    try:
+                        stream = self._call(cached_model.generate_content, timeout, stream=True)([prompt, image])
+                    except Exception as e:
+                        if not cached_content_missing(e):
+                            raise
+                        loop.call_soon_threadsafe(self.instructions.drop, instruction)
+                if stream is None:
+                    stream = self._call(self.model.generate_content, timeout, stream=True)(
+                        [with_instruction(prompt, instruction), image]
+                    )
+                usage = None
+                for chunk in stream:
+                    if stop.is_set():
+                        break
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk.text)
+                    # Every chunk reports the usage so far; the last one has the totals.
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                loop.call_soon_threadsafe(self._record_usage_metadata, usage)
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+        loop.run_in_executor(self.executor, produce)
+        try:
+            while True:
+                item = await chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    async def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DummyBackend(InferenceBackend):
+    """
+    Random structured output for testing without a model.
+    """
+
+    name = "dummy"
+
+    async def generate(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        disease_names = ["Eczema", "Psoriasis", "Dermatitis", "Rosacea", "Fungal Infection"]
+        random.shuffle(disease_names)
+        percentages = [random.randint(20, 50) for _ in range(3)]
+        total = sum(percentages)
+        percentages = [round(p * 100 / total) for p in percentages]
+        diff = 100 - sum(percentages)
+        if diff != 0:
+            percentages[0] += diff
+
+        top_diseases = [
+            {"name": disease_names[i], "confidence": percentages[i]}
+            for i in range(3)
+        ]
+
+        return json.dumps({
+            "top_3_possible_diseases": top_diseases,
+            "explanation": f"Based on the uploaded image and your reported symptoms ({symptoms}), these are the most likely skin conditions.",
+            "urgency": "Moderate",
+            "recommended_next_steps": [
+                "Keep the affected area clean and dry.",
+                "Avoid harsh soaps or chemicals.",
+                "Consult a certified dermatologist for a detailed examination."
+            ],
+            "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
+        })
+
+    async def generate_batch(self, prompt, images, symptoms_list, mime_type="image/jpeg", timeout=None):
+        answers = [
+            await self.generate(prompt, image_bytes, symptoms, mime_type, timeout=timeout)
+            for image_bytes, symptoms in zip(images, symptoms_list)
+        ]
+        return "[" + ",".join(answers) + "]"
+
+
+class FakeGeminiBackend(InferenceBackend):
+    """
+    Calls a local fake Gemini server (see fake_gemini.py) over HTTP.
+
+    Requests and responses use the shape of Gemini's REST generateContent API,
+    so payload encoding and network time are paid for as they would be upstream.
+    Instruction blocks are cached through the REST cachedContents API, as
+    GeminiBackend does through the SDK.
+    """
+
+    name = "fake"
+
+    def __init__(self, base_url, model_name="gemini-2.5-flash", timeout=120.0, structured_output=True, cache_ttl=3600):
+        self.model_name = model_name
+        self.model_url = f"{base_url.rstrip('/')}/v1beta/models/{model_name}"
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model_name}:generateContent"
+        self.stream_url = f"{base_url.rstrip('/')}/v1beta/models/{model_name}:streamGenerateContent"
+        self.cache_url = f"{base_url.rstrip('/')}/v1beta/cachedContents"
+        self.client = httpx.AsyncClient(timeout=timeout)
+        self.structured_output = structured_output
+        self.cache_ttl = cache_ttl
+        self.instructions = InstructionCache(self._cache_name, cache_ttl) if cache_ttl > 0 else None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            os.getenv("FAKE_GEMINI_URL", "http://127.0.0.1:8001"),
+            model_name=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"),
+            structured_output=structured_output_enabled(),
+            cache_ttl=int(os.getenv("GEMINI_CACHE_TTL", "3600")),
+        )
+
+    @staticmethod
+    def _timeout(timeout):
+        # Per-request override of the client's default timeout.
+        return {"timeout": timeout} if timeout is not None else {}
+
+    async def _cache_name(self, instruction):
+        payload = {
+            "model": f"models/{self.model_name}",
+            "systemInstruction": {"parts": [{"text": instruction}]},
+            "ttl": f"{self.cache_ttl}s",
+        }
+        try:
+            response = await self.client.post(self.cache_url, json=payload)
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Fake Gemini request failed: {e}") from e
+        if response.status_code != 200:
+            raise UpstreamError(f"Fake Gemini returned {response.status_code}: {response.text[:200]}", response.status_code)
+        return response.json()["name"]
+
+    async def cache_instruction(self, instruction):
+        if self.instructions is not None:
+            await self.instructions.refresh(instruction)
+
+    def _cached_name(self, instruction):
+        if not instruction or self.instructions is None:
+            return None
+        return self.instructions.get(instruction)
+
+    def _payload(self, prompt, image_bytes, mime_type, cached_content=None):
+        payload = self._request([prompt, {"mime_type": mime_type, "data": image_bytes}], RESPONSE_SCHEMA)
+        if cached_content is not None:
+            payload["cachedContent"] = cached_content
+        return payload
+
+    def _request(self, parts, schema):
+        # The REST API takes parts as {"text": ...} or {"inline_data": ...}.
+        rest_parts = [
+            {"text": part} if isinstance(part, str)
+            else {"inline_data": {"mime_type": part["mime_type"], "data": base64.b64encode(part["data"]).decode("ascii")}}
+            for part in parts
+        ]
+        payload = {"contents": [{"parts": rest_parts}]}
+        if self.structured_output:
+            payload["generationConfig"] = {"responseMimeType": "application/json", "responseSchema": schema}
+        return payload
+
+    async def generate(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        cached_content = self._cached_name(instruction)
+        if cached_content is not None:
+            try:
+                return await self._post(self._payload(prompt, image_bytes, mime_type, cached_content), timeout)
+            except UpstreamError as e:
+                if not cached_content_missing(e):
+                    raise
+                self.instructions.drop(instruction)
+        return await self._post(self._payload(with_instruction(prompt, instruction), image_bytes, mime_type), timeout)
+
+    async def generate_batch(self, prompt, images, symptoms_list, mime_type="image/jpeg", timeout=None):
+        return await self._post(self._request(batch_parts(prompt, images, mime_type), BATCH_RESPONSE_SCHEMA), timeout)
+
+    async def _post(self, payload, timeout=None):
+        try:
+            response = await self.client.post(self.url, json=payload, **self._timeout(timeout))
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Fake Gemini request failed: {e}") from e
+
+        if response.status_code != 200:
+            raise UpstreamError(f"Fake Gemini returned {response.status_code}: {response.text[:200]}", response.status_code)
+
+        body = response.json()
+        self._record_rest_usage(body.get("usageMetadata"))
+        return body["candidates"][0]["content"]["parts"][0]["text"]
+
+    def _record_rest_usage(self, usage):
+        if usage:
+            self._record_usage(
+                usage.get("promptTokenCount", 0), usage.get("cachedContentTokenCount", 0),
+                usage.get("candidatesTokenCount", 0),
+            )
+
+    async def generate_stream(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        cached_content = self._cached_name(instruction)
+        if cached_content is not None:
+            try:
+                async for text in self._stream(self._payload(prompt, image_bytes, mime_type, cached_content), timeout):
+                    yield text
+                return
+            except UpstreamError as e:
+                # Only the status check can raise this for a missing cache, before anything was yielded.
+                if not cached_content_missing(e):
+                    raise
+                self.instructions.drop(instruction)
+        async for text in self._stream(
+            self._payload(with_instruction(prompt, instruction), image_bytes, mime_type), timeout
+        ):
+            yield text
+
+    async def _stream(self, payload, timeout=None):
+        try:
+            async with self.client.stream(
+                "POST", self.stream_url, params={"alt": "sse"}, json=payload, **self._timeout(timeout)
+            ) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise UpstreamError(
+                        f"Fake Gemini returned {response.status_code}: {body[:200].decode(errors='replace')}",
+                        response.status_code,
+                    )
+                usage = None
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        chunk = json.loads(line[5:])
+                        usage = chunk.get("usageMetadata") or usage
+                        yield chunk["candidates"][0]["content"]["parts"][0]["text"]
+                self._record_rest_usage(usage)
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Fake Gemini request failed: {e}") from e
+
+    async def warm_up(self):
+        # Opens a pooled connection; the model metadata itself is not needed.
+        try:
+            await self.client.get(self.model_url)
+        except httpx.HTTPError as e:
+            raise UpstreamError(f"Fake Gemini request failed: {e}") from e
+
+    async def close(self):
+        await self.client.aclose()
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "dummy": DummyBackend,
+    "fake": FakeGeminiBackend,
+}
+
+
+def create_backend(name=None):
+    """
+    Build the backend named by INFERENCE_BACKEND.
+
+    Defaults to Gemini when the SDK is installed and the dummy backend otherwise.
+    """
+    if name is None:
+        name = os.getenv("INFERENCE_BACKEND") or ("gemini" if gemini_available() else "dummy")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND {name!r}, expected one of {sorted(BACKENDS)}")
+
+    backend_class = BACKENDS[name]
+    if hasattr(backend_class, "from_env"):
+        return backend_class.from_env()
+    return backend_class()
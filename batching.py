@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+
+class MicroBatcher:
+    """
+    Collect calls that arrive close together and run them as one batch.
+
+    The first item submitted opens a window of `window` seconds; everything
+    submitted before it closes, up to max_size items, is passed to
+    run_batch(items) in one call, which returns one result per item in order.
+    A result that is an exception is raised to that item's caller only; an
+    exception raised by run_batch goes to every caller in the batch.
+
+    Callers that give up before their batch starts are left out of it, and a
+    running batch is cancelled once every caller in it has given up.
+
+    on_batch(size, queue_delays) is called as each batch starts, with the
+    seconds each item waited for its window to close.
+    """
+
+    def __init__(self, run_batch, window=0.02, max_size=8, on_batch=None):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_size = max_size
+        self.on_batch = on_batch
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future, time.monotonic()))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = [(item, future, queued) for item, future, queued in self._pending if not future.done()]
+        self._pending = []
+        if not batch:
+            return
+
+        if self.on_batch is not None:
+            now = time.monotonic()
+            self.on_batch(len(batch), [now - queued for _, _, queued in batch])
+        futures = [future for _, future, _ in batch]
+        task = asyncio.ensure_future(self.run_batch([item for item, _, _ in batch]))
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._finish(t, futures))
+
+        def abandon(_):
+            if not task.done() and all(future.cancelled() for future in futures):
+                task.cancel()
+
+        for future in futures:
+            future.add_done_callback(abandon)
+
+    def _finish(self, task, futures):
+        self._tasks.discard(task)
+        if task.cancelled():
+            for future in futures:
+                future.cancel()
+            return
+        error = task.exception()
+        results = [error] * len(futures) if error is not None else task.result()
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
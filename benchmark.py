@@ -0,0 +1,604 @@
+"""
+Benchmark suite for the prediction endpoints.
+
+Drives the FastAPI app in-process over a matrix of scenarios (backend,
+endpoint, concurrency, image size, symptom length) and reports latency
+percentiles, throughput and peak RSS for each. Results are written as JSON
+so runs from different commits can be compared.
+
+Client and server share one process, so client-side encoding is included in
+the latencies and peak RSS is the process high-water mark during a scenario,
+not memory attributable to that scenario alone. Compare runs made on the same
+machine with the same arguments.
+
+Backends:
+    dummy     the built-in random backend, no model latency; isolates the
+              decode/normalize/parse/serialize path
+    latency   the dummy backend behind an injected latency distribution
+              (see fake_gemini.parse_latency for the spec format)
+    fake      the HTTP fake Gemini server at --fake-url (start it with
+              python fake_gemini.py)
+
+--micro runs microbenchmarks instead: CPU microseconds per call of stdlib
+json against orjson for rendering a response body and parsing model output,
+and peak traced memory for reading a JSON upload of --body-mb megabytes of
+image, buffered and decoded whole against streamed through JsonImageParser.
+
+--store measures the persistent prediction store: write and lookup latency,
+write amplification (bytes the process passed to write syscalls per byte of
+key and prediction, before and after a checkpoint folds the WAL back into the
+database), warm-up time and compaction.
+
+--startup measures cold starts in fresh processes: time to import the server,
+time from the startup hook to /readyz answering 200, and process start to
+ready. The backend is whatever INFERENCE_BACKEND selects; set BACKEND_WARMUP=1
+to include the warm-up call.
+
+Usage:
+    python benchmark.py --output bench_results.json
+    python benchmark.py --micro
+    python benchmark.py --store --store-entries 20000
+    python benchmark.py --startup --startup-runs 10
+    python benchmark.py --backends latency --latency lognormal:0.2,0.5 --concurrency 1,16,64
+    python benchmark.py --compare old.json --output new.json
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import httpx
+from PIL import Image
+
+# Keep per-request log lines out of the report unless asked for; set LOG_LEVEL to override.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Every benchmark request comes from one client, so per-client limits would only measure 429s.
+os.environ.setdefault("RATE_LIMITS", "")
+os.environ.setdefault("PREDICTION_STORE_PATH", "")
+
+import json_codec  # noqa: E402
+import server  # noqa: E402
+from backends import DummyBackend, FakeGeminiBackend  # noqa: E402
+from fake_gemini import parse_latency  # noqa: E402
+from json_upload import JsonImageParser  # noqa: E402
+from prediction_cache import PredictionCache  # noqa: E402
+from prediction_store import PredictionStore  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+
+class LatencyBackend(DummyBackend):
+    """
+    Dummy backend that sleeps for a sampled latency before answering, like a remote model.
+    """
+
+    name = "latency"
+
+    def __init__(self, latency_spec):
+        self.sample_latency = parse_latency(latency_spec)
+
+    async def generate(self, prompt, image_bytes, symptoms, mime_type="image/jpeg", instruction=None, timeout=None):
+        await asyncio.sleep(self.sample_latency())
+        return await super().generate(prompt, image_bytes, symptoms, mime_type, instruction, timeout)
+
+
+def make_backend(name, args):
+    if name == "dummy":
+        return DummyBackend()
+    if name == "latency":
+        return LatencyBackend(args.latency)
+    if name == "fake":
+        return FakeGeminiBackend(args.fake_url)
+    raise ValueError(f"Unknown benchmark backend {name!r}")
+
+
+def make_image(edge, seed=0):
+    """
+    A noisy RGB JPEG with the given longest edge. Noise keeps the encoded size
+    close to a real photo's instead of compressing to almost nothing.
+    """
+    rng = random.Random(seed)
+    width, height = edge, edge * 3 // 4
+    image = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=85)
+    return output.getvalue()
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: fall back to the process high-water mark.
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class RSSSampler:
+    """
+    Samples resident memory on a background thread and keeps the peak.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies):
+    """
+    Latency percentiles in milliseconds for a list of durations in seconds.
+    """
+    values = sorted(latencies)
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+async def run_scenario(client, endpoint, image_bytes, symptoms, concurrency, num_requests, tag="run"):
+    """
+    Send num_requests predictions with at most concurrency in flight and time each one.
+    """
+    image_base64 = base64.b64encode(image_bytes).decode("ascii")
+    latencies = []
+    errors = 0
+    counter = iter(range(num_requests))
+
+    async def send(i):
+        # A unique suffix keeps every request out of the cache and the single-flight map.
+        request_symptoms = f"{symptoms} #{tag}-{i}"
+        if endpoint == "predict_json":
+            return await client.post("/predict_json", json={"symptoms": request_symptoms, "image_base64": image_base64})
+        return await client.post(
+            "/predict",
+            params={"symptoms": request_symptoms},
+            content=image_bytes,
+            headers={"content-type": "application/octet-stream"},
+        )
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            response = await send(i)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+
+async def bench_requests(args):
+    results = []
+    images = {edge: make_image(edge) for edge in args.image_sizes}
+    symptom_texts = {length: ("itchy red patch on forearm " * (length // 27 + 1))[:length] for length in args.symptom_lengths}
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for backend_name in args.backends:
+            server.backend = make_backend(backend_name, args)
+            for endpoint in args.endpoints:
+                for concurrency in args.concurrency:
+                    for edge, image_bytes in images.items():
+                        for length, symptoms in symptom_texts.items():
+                            name = f"{backend_name}/{endpoint}/c{concurrency}/img{edge}/sym{length}"
+                            server.prediction_cache.clear()
+
+                            # Warm up so one-time costs don't land in the first percentile bucket.
+                            await run_scenario(client, endpoint, image_bytes, symptoms, 1, min(args.warmup, args.requests), tag="warmup")
+                            with RSSSampler() as rss:
+                                latencies, errors, elapsed = await run_scenario(
+                                    client, endpoint, image_bytes, symptoms, concurrency, args.requests
+                                )
+
+                            result = {
+                                "name": name,
+                                "backend": backend_name,
+                                "endpoint": endpoint,
+                                "concurrency": concurrency,
+                                "image_edge": edge,
+                                "image_bytes": len(image_bytes),
+                                "symptom_length": length,
+                                "requests": args.requests,
+                                "errors": errors,
+                                "throughput_rps": round(args.requests / elapsed, 2),
+                                "peak_rss_mb": round(rss.peak / (1024 * 1024), 2),
+                                **summarize_latencies(latencies),
+                            }
+                            results.append(result)
+                            print(
+                                f"{name:<48} p50 {result['p50_ms']:>9.2f}ms  p95 {result['p95_ms']:>9.2f}ms  "
+                                f"p99 {result['p99_ms']:>9.2f}ms  {result['throughput_rps']:>8.1f} req/s  "
+                                f"rss {result['peak_rss_mb']:>7.1f}MB  errors {errors}"
+                            )
+            await server.backend.close()
+    return results
+
+
+def cpu_per_call(fn, iterations):
+    """
+    CPU microseconds per call of fn, averaged over iterations.
+    """
+    fn()
+    start = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def bench_json(iterations):
+    """
+    Compare stdlib json with orjson on the JSON work done once per prediction request.
+    """
+    if not json_codec.ORJSON_AVAILABLE:
+        print("orjson is not installed; nothing to compare")
+        return []
+
+    import orjson
+
+    model_text = asyncio.run(DummyBackend().generate("", b"", "itchy red patch on forearm " * 20))
+    body = {"prediction": json.loads(model_text)}
+    cases = {
+        "render_response": (lambda: JSONResponse(content=body), lambda: json_codec.FastJSONResponse(content=body)),
+        "parse_model_output": (lambda: json.loads(model_text), lambda: orjson.loads(model_text)),
+    }
+
+    results = []
+    print(f"{'case':<20} {'stdlib_us':>10} {'orjson_us':>10} {'saved_us':>10}")
+    for name, (stdlib_fn, orjson_fn) in cases.items():
+        stdlib_us = cpu_per_call(stdlib_fn, iterations)
+        orjson_us = cpu_per_call(orjson_fn, iterations)
+        result = {
+            "case": name,
+            "stdlib_us": round(stdlib_us, 2),
+            "orjson_us": round(orjson_us, 2),
+            "saved_us": round(stdlib_us - orjson_us, 2),
+        }
+        results.append(result)
+        print(f"{name:<20} {result['stdlib_us']:>10} {result['orjson_us']:>10} {result['saved_us']:>10}")
+    print(f"CPU saved per request: {sum(r['saved_us'] for r in results):.1f}us")
+    return results
+
+
+def peak_memory(fn):
+    """
+    Peak memory in MB traced by tracemalloc while fn runs.
+    """
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    finally:
+        tracemalloc.stop()
+
+
+def bench_body_memory(image_mb):
+    """
+    Compare peak memory of decoding a JSON upload buffered whole with streaming it in chunks.
+    """
+    image = random.Random(0).randbytes(int(image_mb * 1024 * 1024))
+    body = json.dumps({"symptoms": "itchy red patch", "image_base64": base64.b64encode(image).decode()}).encode()
+    chunks = [body[i:i + 65536] for i in range(0, len(body), 65536)]
+    del image
+
+    def buffered():
+        # What FastAPI did for a PredictRequest body: join, parse, validate, decode.
+        request = server.PredictRequest.model_validate_json(b"".join(chunks))
+        return base64.b64decode(request.image_base64)
+
+    def streamed():
+        parser = JsonImageParser(max_image_bytes=len(body))
+        for chunk in chunks:
+            parser.feed(chunk)
+        return parser.finish()
+
+    result = {
+        "body_mb": round(len(body) / (1024 * 1024), 2),
+        "buffered_peak_mb": round(peak_memory(buffered), 2),
+        "streamed_peak_mb": round(peak_memory(streamed), 2),
+    }
+    print(f"\nJSON upload of {result['body_mb']}MB: peak {result['buffered_peak_mb']}MB buffered, "
+          f"{result['streamed_peak_mb']}MB streamed")
+    return result
+
+
+def bytes_written_by_process():
+    """
+    Bytes this process has passed to write syscalls so far, from /proc/self/io; None where unavailable.
+    """
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def latency_summary_us(samples):
+    ordered = sorted(samples)
+    return {
+        "p50_us": round(percentile(ordered, 50) * 1e6, 1),
+        "p99_us": round(percentile(ordered, 99) * 1e6, 1),
+    }
+
+
+def bench_store(entries):
+    """
+    Write, look up, warm from and compact a PredictionStore of the given size in a temporary directory.
+    """
+    prediction = json.loads(asyncio.run(DummyBackend().generate("", b"", "itchy red patch")))
+    rng = random.Random(0)
+    keys = [rng.randbytes(32).hex() for _ in range(entries)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = PredictionStore(os.path.join(directory, "predictions.db"), max_entries=entries)
+        # The store's own methods run on its background thread; call the synchronous halves to time SQLite itself.
+        written_before = bytes_written_by_process()
+        write_times = []
+        for key in keys:
+            start = time.perf_counter()
+            store._put(key, prediction)
+            write_times.append(time.perf_counter() - start)
+        written_after_puts = bytes_written_by_process()
+        store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        written_after_checkpoint = bytes_written_by_process()
+        logical = store.bytes_written
+
+        hit_times = []
+        for key in rng.sample(keys, min(entries, 5000)):
+            start = time.perf_counter()
+            store._get(key)
+            hit_times.append(time.perf_counter() - start)
+        miss_times = []
+        for i in range(min(entries, 5000)):
+            start = time.perf_counter()
+            store._get(f"{i:064x}")
+            miss_times.append(time.perf_counter() - start)
+
+        async def threaded_gets():
+            samples = []
+            for key in rng.sample(keys, min(entries, 2000)):
+                start = time.perf_counter()
+                await store.get(key)
+                samples.append(time.perf_counter() - start)
+            return samples
+
+        cache = PredictionCache(max_entries=1024)
+        start = time.perf_counter()
+        for key, value, age in reversed(asyncio.run(store.recent(cache.max_entries))):
+            cache.set(key, value, ttl=store.ttl - age)
+        warm_s = time.perf_counter() - start
+        memory_times = []
+        for key in rng.sample(keys[-len(cache):], len(cache)):
+            start = time.perf_counter()
+            cache.get(key)
+            memory_times.append(time.perf_counter() - start)
+
+        file_bytes_full = store.file_bytes()
+        store.max_entries = entries // 2
+        start = time.perf_counter()
+        removed = store._compact()
+        compact_s = time.perf_counter() - start
+
+        result = {
+            "entries": entries,
+            "put": latency_summary_us(write_times),
+            "get_hit": latency_summary_us(hit_times),
+            "get_miss": latency_summary_us(miss_times),
+            "get_hit_via_thread": latency_summary_us(asyncio.run(threaded_gets())),
+            "memory_cache_hit": latency_summary_us(memory_times),
+            "logical_mb": round(logical / (1024 * 1024), 2),
+            "file_mb": round(file_bytes_full / (1024 * 1024), 2),
+            "warm_ms": round(warm_s * 1000, 1),
+            "warm_entries": len(cache),
+            "compact_removed": removed,
+            "compact_ms": round(compact_s * 1000, 1),
+            "file_mb_after_compact": round(store.file_bytes() / (1024 * 1024), 2),
+        }
+        if written_before is not None:
+            result["write_amplification"] = round((written_after_puts - written_before) / logical, 2)
+            result["write_amplification_with_checkpoint"] = round((written_after_checkpoint - written_before) / logical, 2)
+        store.close()
+
+    print(f"prediction store with {entries} entries ({result['logical_mb']}MB of keys and predictions, "
+          f"{result['file_mb']}MB on disk)")
+    for name in ("put", "get_hit", "get_miss", "get_hit_via_thread", "memory_cache_hit"):
+        print(f"  {name:<20} p50 {result[name]['p50_us']:>8.1f}us  p99 {result[name]['p99_us']:>8.1f}us")
+    if "write_amplification" in result:
+        print(f"  write amplification  {result['write_amplification']}x to the WAL, "
+              f"{result['write_amplification_with_checkpoint']}x including the checkpoint")
+    print(f"  warm-up              {result['warm_entries']} entries in {result['warm_ms']}ms")
+    print(f"  compaction           removed {result['compact_removed']} in {result['compact_ms']}ms, "
+          f"{result['file_mb']}MB -> {result['file_mb_after_compact']}MB")
+    return result
+
+
+# Run in a fresh interpreter by bench_startup; prints its timings as JSON.
+STARTUP_PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+import httpx
+import server
+imported = time.perf_counter()
+
+async def wait_ready():
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            while True:
+                response = await client.get("/readyz")
+                if response.status_code == 200 or response.json()["status"] == "failed":
+                    return response.json()["status"]
+                await asyncio.sleep(0.002)
+
+status = asyncio.run(wait_ready())
+print(json.dumps({"status": status, "import_s": imported - start, "ready_s": time.perf_counter() - imported}))
+"""
+
+
+def bench_startup(runs):
+    """
+    Cold-start the server in fresh processes and report median timings.
+    """
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample["process_s"] = time.perf_counter() - start
+        samples.append(sample)
+
+    result = {"runs": runs, "status": samples[-1]["status"]}
+    for key in ("import_s", "ready_s", "process_s"):
+        result[key] = round(statistics.median(s[key] for s in samples), 4)
+    print(f"startup over {runs} runs (median): import {result['import_s'] * 1000:.1f}ms, "
+          f"startup hook to ready {result['ready_s'] * 1000:.1f}ms, process to ready {result['process_s'] * 1000:.1f}ms "
+          f"[{result['status']}]")
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, results, threshold):
+    """
+    Print p50/p95 changes against a previous results file and return the regressed scenario names.
+    """
+    with open(old_path) as f:
+        old = {r["name"]: r for r in json.load(f)["scenarios"]}
+
+    regressions = []
+    print(f"\nCompared with {old_path}:")
+    for result in results:
+        before = old.get(result["name"])
+        if before is None:
+            continue
+        changes = []
+        for metric in ("p50_ms", "p95_ms"):
+            if before[metric] > 0:
+                change = (result[metric] - before[metric]) / before[metric]
+                changes.append(f"{metric} {change:+.1%}")
+                if change > threshold:
+                    regressions.append(result["name"])
+        print(f"  {result['name']:<48} {'  '.join(changes)}")
+    return sorted(set(regressions))
+
+
+def parse_list(cast):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=parse_list(str), default=["dummy", "latency"])
+    parser.add_argument("--endpoints", type=parse_list(str), default=["predict_json", "predict"])
+    parser.add_argument("--concurrency", type=parse_list(int), default=[1, 16])
+    parser.add_argument("--image-sizes", type=parse_list(int), default=[400, 1600], help="longest image edge in pixels")
+    parser.add_argument("--symptom-lengths", type=parse_list(int), default=[64, 2048])
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=5, help="sequential warm-up requests per scenario")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="latency spec for the latency backend")
+    parser.add_argument("--fake-url", default=os.getenv("FAKE_GEMINI_URL", "http://127.0.0.1:8001"))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative p50/p95 slowdown that counts as a regression")
+    parser.add_argument("--micro", action="store_true", help="run the JSON microbenchmarks instead of the request matrix")
+    parser.add_argument("--iterations", type=int, default=20000, help="calls per microbenchmark case")
+    parser.add_argument("--body-mb", type=float, default=8, help="image size for the upload memory microbenchmark")
+    parser.add_argument("--startup", action="store_true", help="measure cold-start time instead of the request matrix")
+    parser.add_argument("--startup-runs", type=int, default=5)
+    parser.add_argument("--store", action="store_true", help="benchmark the persistent prediction store instead of the request matrix")
+    parser.add_argument("--store-entries", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.store:
+        bench_store(args.store_entries)
+        return
+
+    if args.startup:
+        bench_startup(args.startup_runs)
+        return
+
+    if args.micro:
+        bench_json(args.iterations)
+        bench_body_memory(args.body_mb)
+        return
+
+    results = asyncio.run(bench_requests(args))
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {len(results)} scenarios to {args.output}")
+
+    if args.compare:
+        regressions = compare(args.compare, results, args.threshold)
+        if regressions:
+            print(f"\nRegressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from logging_config import logger
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# Numeric value of each state for the Prometheus gauge.
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling the upstream while the breaker is open.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__("Upstream model is unavailable, circuit breaker is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that is failing or too slow.
+
+    The outcome of the last `window` calls is kept. Once at least min_calls are
+    recorded and either the failure rate reaches failure_rate or the share of
+    calls slower than slow_call_seconds reaches slow_call_rate, the breaker
+    opens and calls fail immediately with CircuitOpenError. After open_seconds
+    it goes half-open and lets up to half_open_probes calls through: a healthy
+    probe closes it again, a failed or slow one reopens it.
+
+    is_failure(exc) decides whether an exception says the upstream is
+    unhealthy; others, such as a request rejected as invalid, pass through
+    unrecorded. By default every exception counts.
+
+    on_state_change(state) is called with the new state on every transition.
+    """
+
+    def __init__(self, window=20, min_calls=10, failure_rate=0.5, slow_call_seconds=30.0,
+                 slow_call_rate=0.5, open_seconds=30.0, half_open_probes=1, is_failure=None,
+                 on_state_change=None):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.is_failure = is_failure
+        self.on_state_change = on_state_change
+        self._calls = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def retry_after(self):
+        return max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+
+    def check(self):
+        """
+        Raise CircuitOpenError if a call made now would not be let through.
+        """
+        state = self.state
+        if state == OPEN or (state == HALF_OPEN and self._probes >= self.half_open_probes):
+            raise CircuitOpenError(self.retry_after())
+
+    @asynccontextmanager
+    async def call(self):
+        """
+        Guard one upstream call. Exceptions raised inside that is_failure
+        accepts count as failures; other exceptions and cancellation are not
+        counted either way.
+        """
+        self.check()
+        probe = self._state == HALF_OPEN
+        if probe:
+            self._probes += 1
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if self.is_failure is None or self.is_failure(e):
+                self._record(failed=True, slow=False, probe=probe)
+            elif probe:
+                self._probes -= 1
+            raise
+        except BaseException:
+            if probe:
+                self._probes -= 1
+            raise
+        else:
+            self._record(failed=False, slow=time.monotonic() - start >= self.slow_call_seconds, probe=probe)
+
+    def _record(self, failed, slow, probe):
+        if probe:
+            self._probes -= 1
+            if self._state == HALF_OPEN:
+                self._transition(OPEN if failed or slow else CLOSED)
+            return
+        if self._state != CLOSED:
+            # A call that started before the breaker opened.
+            return
+
+        self._calls.append((failed, slow))
+        if len(self._calls) < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._calls if failed)
+        slow_calls = sum(1 for _, slow in self._calls if slow)
+        if failures / len(self._calls) >= self.failure_rate or slow_calls / len(self._calls) >= self.slow_call_rate:
+            self._transition(OPEN)
+
+    def _transition(self, state):
+        logger.warning("circuit breaker state changed", extra={"from_state": self._state, "to_state": state})
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == CLOSED:
+            self._calls.clear()
+        if self.on_state_change is not None:
+            self.on_state_change(state)
@@ -0,0 +1,122 @@
+import asyncio
+import contextvars
+import json
+import time
+
+# Absolute time.monotonic() by which the current request must be answered.
+deadline_var = contextvars.ContextVar("deadline", default=None)
+
+
+def remaining(default=None):
+    """
+    Seconds left before the current request's deadline, or default when there is none.
+    """
+    deadline = deadline_var.get()
+    if deadline is None:
+        return default
+    return deadline - time.monotonic()
+
+
+def request_timeout(scope, default, maximum):
+    """
+    The client's X-Request-Timeout in seconds, capped at maximum, or default when absent or invalid.
+    """
+    for name, value in scope["headers"]:
+        if name == b"x-request-timeout":
+            try:
+                timeout = float(value)
+            except ValueError:
+                break
+            if timeout > 0:
+                return min(timeout, maximum)
+            break
+    return default
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that gives each request a deadline and abandons work nobody will receive.
+
+    The deadline comes from the client's X-Request-Timeout header (relative
+    seconds, so clock skew does not matter) or default_timeout, and is published
+    in deadline_var for downstream timeouts. The handler task is cancelled if
+    the deadline passes before the response starts, answering 504, or if the
+    client disconnects first. on_cancel(reason) is called with "deadline" or
+    "disconnect" each time.
+
+    Once a response has started, streaming endpoints handle disconnects themselves.
+    """
+
+    def __init__(self, app, default_timeout=85.0, max_timeout=120.0, on_cancel=None):
+        self.app = app
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.on_cancel = on_cancel
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timeout = request_timeout(scope, self.default_timeout, self.max_timeout)
+        task = asyncio.current_task()
+        disconnected = asyncio.Event()
+        response_started = False
+        cancel_reason = None
+        body_received = False
+        watcher = None
+
+        def cancel(reason):
+            nonlocal cancel_reason
+            if response_started or cancel_reason is not None:
+                return
+            cancel_reason = reason
+            task.cancel()
+
+        async def watch_disconnect():
+            # After the body, the only message the server can send is http.disconnect.
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+                cancel("disconnect")
+
+        async def receive_wrapper():
+            nonlocal body_received, watcher
+            if body_received:
+                # The watcher owns receive() now; relay what it sees.
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                body_received = True
+                watcher = asyncio.create_task(watch_disconnect())
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        timer = asyncio.get_running_loop().call_later(timeout, cancel, "deadline")
+        token = deadline_var.set(time.monotonic() + timeout)
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except asyncio.CancelledError:
+            if cancel_reason is None:
+                raise
+            task.uncancel()
+            if self.on_cancel is not None:
+                self.on_cancel(cancel_reason)
+            if cancel_reason == "deadline":
+                body = json.dumps({"detail": f"Request did not finish within {timeout:g}s"}).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": 504,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+                })
+                await send({"type": "http.response.body", "body": body})
+        finally:
+            timer.cancel()
+            if watcher is not None:
+                watcher.cancel()
+            deadline_var.reset(token)
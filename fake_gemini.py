@@ -0,0 +1,234 @@
+"""
+Local stand-in for the Gemini generateContent REST API.
+
+Serves POST /v1beta/models/{model}:generateContent with configurable latency
+and failure injection so the server can be benchmarked and load-tested
+without a real model. POST /v1beta/cachedContents caches an instruction
+block that later calls name in "cachedContent", and usageMetadata reports
+roughly the tokens a real call would. Point the server at it with:
+
+    INFERENCE_BACKEND=fake FAKE_GEMINI_URL=http://127.0.0.1:8001 uvicorn server:app
+
+Usage:
+    python fake_gemini.py --port 8001 --latency lognormal:0.8,0.4 --failure-rate 0.02
+
+Latency specs (seconds):
+    fixed:S               always S
+    uniform:LO,HI         uniformly distributed between LO and HI
+    normal:MEAN,STD       normal, clipped at 0
+    lognormal:MEDIAN,SIGMA  log-normal with the given median, for a realistic long tail
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Gemini bills an image at a flat token count.
+IMAGE_TOKENS = 258
+
+DISEASES = ["Eczema", "Psoriasis", "Dermatitis", "Rosacea", "Fungal Infection", "Acne", "Urticaria"]
+
+
+def parse_latency(spec):
+    """
+    Turn a latency spec such as "lognormal:0.8,0.4" into a zero-argument sampler.
+    """
+    kind, _, args = spec.partition(":")
+    params = [float(p) for p in args.split(",")] if args else []
+
+    if kind == "fixed" and len(params) == 1:
+        return lambda: params[0]
+    if kind == "uniform" and len(params) == 2:
+        return lambda: random.uniform(params[0], params[1])
+    if kind == "normal" and len(params) == 2:
+        return lambda: max(0.0, random.gauss(params[0], params[1]))
+    if kind == "lognormal" and len(params) == 2:
+        mu = math.log(params[0])
+        return lambda: random.lognormvariate(mu, params[1])
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+def fake_prediction_text(fenced=False):
+    names = random.sample(DISEASES, 3)
+    weights = sorted((random.randint(5, 70) for _ in range(3)), reverse=True)
+    total = sum(weights)
+    confidences = [round(w * 100 / total) for w in weights]
+    confidences[0] += 100 - sum(confidences)
+
+    text = json.dumps({
+        "top_3_possible_diseases": [
+            {"name": name, "confidence": confidence} for name, confidence in zip(names, confidences)
+        ],
+        "explanation": "Simulated analysis from the fake Gemini server.",
+        "urgency": random.choice(["Low", "Moderate", "High"]),
+        "recommended_next_steps": [
+            "Keep the affected area clean and dry.",
+            "Avoid harsh soaps or chemicals.",
+            "Consult a certified dermatologist for a detailed examination."
+        ],
+        "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
+    }, indent=2)
+    if fenced:
+        # Real Gemini output sometimes arrives wrapped in a markdown code block.
+        text = f"```json\n{text}\n```"
+    return text
+
+
+def estimate_tokens(parts):
+    # About four characters per text token, as with the real tokenizer on English.
+    return sum(len(part["text"]) // 4 if "text" in part else IMAGE_TOKENS for part in parts)
+
+
+def parse_duration(value):
+    """
+    Seconds from a duration in the REST API's "3600s" form.
+    """
+    return float(value.rstrip("s"))
+
+
+def create_app(latency="fixed:0", failure_rate=0.0, malformed_rate=0.0, fenced_rate=0.0, cache_min_tokens=0):
+    sample_latency = parse_latency(latency)
+    app = FastAPI(title="Fake Gemini")
+    app.state.calls = 0
+    # Cached content name -> (token count, expiry as time.monotonic()).
+    app.state.caches = {}
+    cache_ids = itertools.count(1)
+
+    def injected_failure():
+        if random.random() < failure_rate:
+            status = random.choice([429, 500, 503])
+            return JSONResponse(status_code=status, content={"error": {"code": status, "message": "Injected failure"}})
+        return None
+
+    def response_text(body):
+        images = sum("inline_data" in part for content in body.get("contents", []) for part in content.get("parts", []))
+        if images > 1:
+            # A batched call answers every case, in order.
+            return "[" + ",".join(fake_prediction_text() for _ in range(images)) + "]"
+        # With a JSON response schema the real API only returns the bare object.
+        if body.get("generationConfig", {}).get("responseMimeType") == "application/json":
+            return fake_prediction_text()
+        if random.random() < malformed_rate:
+            return "I'm sorry, I can't provide a structured analysis of this image."
+        return fake_prediction_text(fenced=random.random() < fenced_rate)
+
+    def prompt_usage(body):
+        """
+        Usage for the request's input, or a 404 response if it names a cache that does not exist.
+        """
+        tokens = estimate_tokens(part for content in body.get("contents", []) for part in content.get("parts", []))
+        usage = {"promptTokenCount": tokens}
+        name = body.get("cachedContent")
+        if name is not None:
+            cached_tokens, expires = app.state.caches.get(name, (0, 0))
+            if time.monotonic() >= expires:
+                app.state.caches.pop(name, None)
+                return JSONResponse(
+                    status_code=404, content={"error": {"code": 404, "message": f"CachedContent not found: {name}"}}
+                )
+            usage = {"promptTokenCount": tokens + cached_tokens, "cachedContentTokenCount": cached_tokens}
+        return usage
+
+    def candidate(text, usage, generated=None):
+        # Streamed chunks report usage for everything generated so far, not just their own text.
+        generated = text if generated is None else generated
+        return {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": {**usage, "candidatesTokenCount": len(generated) // 4},
+        }
+
+    @app.post("/v1beta/cachedContents")
+    async def create_cached_content(body: dict):
+        tokens = estimate_tokens(body.get("systemInstruction", {}).get("parts", []))
+        if tokens < cache_min_tokens:
+            # The real API refuses to cache less than a model-specific minimum.
+            return JSONResponse(status_code=400, content={"error": {
+                "code": 400,
+                "message": f"Cached content is too small. total_token_count={tokens}, min_total_token_count={cache_min_tokens}",
+            }})
+        name = f"cachedContents/fake-{next(cache_ids)}"
+        app.state.caches[name] = (tokens, time.monotonic() + parse_duration(body.get("ttl", "3600s")))
+        return {"name": name, "model": body.get("model"), "usageMetadata": {"totalTokenCount": tokens}}
+
+    @app.delete("/v1beta/cachedContents/{cache_id}")
+    async def delete_cached_content(cache_id: str):
+        app.state.caches.pop(f"cachedContents/{cache_id}", None)
+        return {}
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, body: dict):
+        app.state.calls += 1
+        await asyncio.sleep(sample_latency())
+        usage = prompt_usage(body)
+        if isinstance(usage, JSONResponse):
+            return usage
+        return injected_failure() or candidate(response_text(body), usage)
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate_content(model: str, body: dict):
+        """
+        Server-sent events like the real API with alt=sse: the first chunk arrives
+        after roughly a fifth of the sampled latency and the rest trickle in.
+        """
+        app.state.calls += 1
+        latency = sample_latency()
+        await asyncio.sleep(latency * 0.2)
+        usage = prompt_usage(body)
+        if isinstance(usage, JSONResponse):
+            return usage
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+
+        text = response_text(body)
+        pieces = [text[i:i + 64] for i in range(0, len(text), 64)]
+        delay = latency * 0.8 / max(len(pieces), 1)
+
+        async def events():
+            for i, piece in enumerate(pieces):
+                if i:
+                    await asyncio.sleep(delay)
+                yield f"data: {json.dumps(candidate(piece, usage, text[:(i + 1) * 64]))}\r\n\r\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1beta/models/{model}")
+    async def get_model(model: str):
+        return {"name": f"models/{model}", "supportedGenerationMethods": ["generateContent", "streamGenerateContent"]}
+
+    @app.get("/stats")
+    async def stats():
+        return {"calls": app.state.calls, "cached_contents": len(app.state.caches)}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default=os.getenv("FAKE_LATENCY", "lognormal:0.8,0.4"))
+    parser.add_argument("--failure-rate", type=float, default=float(os.getenv("FAKE_FAILURE_RATE", "0")))
+    parser.add_argument("--malformed-rate", type=float, default=float(os.getenv("FAKE_MALFORMED_RATE", "0")),
+                        help="fraction of responses that are not valid JSON")
+    parser.add_argument("--fenced-rate", type=float, default=float(os.getenv("FAKE_FENCED_RATE", "0.2")),
+                        help="fraction of responses wrapped in a markdown code block")
+    parser.add_argument("--cache-min-tokens", type=int, default=int(os.getenv("FAKE_CACHE_MIN_TOKENS", "0")),
+                        help="refuse to cache instruction blocks smaller than this, as the real API does")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    app = create_app(args.latency, args.failure_rate, args.malformed_rate, args.fenced_rate, args.cache_min_tokens)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Formats Pillow can decode that we accept from clients.
+SUPPORTED_FORMATS = {"JPEG", "PNG", "WEBP", "GIF", "BMP", "TIFF", "MPO"}
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+def check_pixels(image, max_pixels):
+    """
+    Refuse an opened image whose declared size exceeds max_pixels, before any pixels are decoded.
+
+    A small, highly compressible file can declare a huge canvas; the upload
+    byte limit does not bound what decoding it costs.
+    """
+    width, height = image.size
+    if width * height > max_pixels:
+        raise InvalidImageError(f"Image is {width}x{height}, more than {max_pixels} pixels")
+
+
+def normalize_image(image_bytes, max_edge=1024, quality=85, max_pixels=50_000_000):
+    """
+    Decode an uploaded image and re-encode it as a bounded, metadata-free JPEG.
+
+    The real format is sniffed from the bytes, images over max_pixels are
+    refused before decoding, EXIF orientation is applied to
+    the pixels, the longest edge is capped at max_edge and the result is saved
+    without EXIF/ICC/XMP. Returns (jpeg_bytes, info) where info describes the
+    source and how many bytes were saved.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        source_format = image.format
+        if source_format not in SUPPORTED_FORMATS:
+            raise InvalidImageError(f"Unsupported image format: {source_format}")
+        check_pixels(image, max_pixels)
+
+        source_size = image.size
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding.
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise InvalidImageError("Could not decode image") from e
+
+    normalized = output.getvalue()
+    info = {
+        "source_format": source_format,
+        "source_size": source_size,
+        "size": image.size,
+        "bytes_in": len(image_bytes),
+        "bytes_out": len(normalized),
+        "bytes_saved": len(image_bytes) - len(normalized),
+    }
+    return normalized, info
+
+
+def _dhash(image, hash_size):
+    pixels = image.resize((hash_size + 1, hash_size), Image.Resampling.BOX).tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = value << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def fingerprint_image(image_bytes, hash_size=8, check_size=16, max_pixels=50_000_000):
+    """
+    Perceptual difference hashes (dHash) of an image: a hash_size**2-bit int to
+    index by and a check_size**2-bit int to confirm a match with.
+
+    Each bit says whether a pixel of a (size+1) x size grayscale thumbnail is
+    brighter than its right-hand neighbour. Re-encoding, resizing and small
+    crops move only a few bits, so near-duplicate photos end up a small
+    Hamming distance apart. The larger hash sees detail the small one averages
+    away, such as a lesion's exact outline. JPEGs are decoded at reduced
+    scale, so this costs far less than normalize_image.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.format not in SUPPORTED_FORMATS:
+            raise InvalidImageError(f"Unsupported image format: {image.format}")
+        check_pixels(image, max_pixels)
+        image.draft("L", (check_size * 4, check_size * 4))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("L")
+        image.load()
+    except InvalidImageError:
+        raise
+    # ValueError: modes Pillow cannot convert to grayscale, such as LAB TIFFs.
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidImageError("Could not decode image") from e
+    return _dhash(image, hash_size), _dhash(image, check_size)
@@ -0,0 +1,128 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+
+import httpx
+from fastapi import HTTPException
+
+from logging_config import logger
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, image_bytes, symptoms, callback_url=None):
+        self.id = uuid.uuid4().hex
+        self.image_bytes = image_bytes
+        self.symptoms = symptoms
+        self.callback_url = callback_url
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        body = {"job_id": self.id, "status": self.status, "created_at": self.created_at}
+        if self.finished_at is not None:
+            body["finished_at"] = self.finished_at
+        if self.result is not None:
+            body["result"] = self.result
+        if self.error is not None:
+            body["error"] = {"status_code": self.status_code, "detail": self.error}
+        return body
+
+
+class JobQueue:
+    """
+    Bounded queue of prediction jobs processed by a fixed pool of worker tasks.
+
+    process_fn(image_bytes, symptoms) is the same coroutine the synchronous
+    endpoints use. Finished jobs are kept for ttl seconds and then forgotten.
+    """
+
+    def __init__(self, process_fn, workers=4, max_queued=100, ttl=600, webhook_timeout=10.0):
+        self.process_fn = process_fn
+        self.workers = workers
+        self.ttl = ttl
+        self.webhook_timeout = webhook_timeout
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.jobs = {}
+        self._expiry = deque()
+        self._tasks = []
+        self._client = None
+
+    def start(self):
+        self._client = httpx.AsyncClient(timeout=self.webhook_timeout)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def submit(self, image_bytes, symptoms, callback_url=None):
+        self._purge()
+        job = Job(image_bytes, symptoms, callback_url)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError("Job queue is full")
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        self._purge()
+        return self.jobs.get(job_id)
+
+    def _purge(self):
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            _, job_id = self._expiry.popleft()
+            self.jobs.pop(job_id, None)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job):
+        job.status = "running"
+        try:
+            body = await self.process_fn(job.image_bytes, job.symptoms)
+            job.result = body
+            job.status = "done"
+        except HTTPException as e:
+            job.status = "failed"
+            job.status_code = e.status_code
+            job.error = e.detail
+        except Exception as e:
+            logger.error("job failed", extra={"job_id": job.id, "error": str(e)})
+            job.status = "failed"
+            job.status_code = 500
+            job.error = str(e)
+        finally:
+            # The image is only needed while the job runs.
+            job.image_bytes = None
+            job.finished_at = time.time()
+            self._expiry.append((job.finished_at + self.ttl, job.id))
+
+        if job.callback_url:
+            await self._notify(job)
+
+    async def _notify(self, job):
+        try:
+            await self._client.post(job.callback_url, json=job.to_dict())
+        except httpx.HTTPError as e:
+            logger.warning("job webhook failed", extra={"job_id": job.id, "error": str(e)})
@@ -0,0 +1,48 @@
+"""
+JSON encoding and decoding through orjson when it is installed.
+
+orjson is optional. Without it everything falls back to the standard library,
+which produces the same values for the data this server handles.
+"""
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+# orjson.JSONDecodeError subclasses this, so callers can catch one type either way.
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    Serialize to compact UTF-8 bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered through orjson, several times faster than the stdlib encoder.
+    """
+
+    def render(self, content):
+        return orjson.dumps(content)
+
+
+# Response class for JSON bodies.
+ResponseClass = FastJSONResponse if ORJSON_AVAILABLE else JSONResponse
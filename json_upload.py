@@ -0,0 +1,226 @@
+"""
+Incremental reader for JSON request bodies that carry a base64 image.
+
+The body is parsed as it arrives. The image field's characters go straight
+into a base64 decoder, four at a time, so the request never exists as one big
+JSON string or Python str. Memory per request stays around one network chunk
+plus the decoded image, which is itself capped.
+"""
+import binascii
+import json
+
+_BASE64_ALPHABET = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=")
+# Deletion table for bytes.translate, which strips these far faster than a regex.
+_NOT_BASE64 = bytes(c for c in range(256) if c not in _BASE64_ALPHABET)
+_WHITESPACE = frozenset(b" \t\r\n")
+
+
+class InvalidBodyError(ValueError):
+    """
+    Raised when the body is not the JSON object we expect.
+    """
+
+
+class PayloadTooLarge(ValueError):
+    """
+    Raised when the decoded image or another field exceeds its limit.
+    """
+
+
+class Base64Decoder:
+    """
+    Decodes base64 fed in arbitrary pieces. Characters outside the base64
+    alphabet (line breaks, spaces) are skipped, as base64.b64decode does.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.output = bytearray()
+        self._pending = b""
+
+    def feed(self, data):
+        data = self._pending + data.translate(None, _NOT_BASE64)
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if not usable:
+            return
+        if len(self.output) + usable // 4 * 3 - 2 > self.max_bytes:
+            raise PayloadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+        try:
+            self.output += binascii.a2b_base64(data[:usable])
+        except binascii.Error as e:
+            raise InvalidBodyError(f"Invalid image_base64: {e}") from None
+
+    def finish(self):
+        if self._pending:
+            raise InvalidBodyError("Invalid image_base64: Incorrect padding")
+        if len(self.output) > self.max_bytes:
+            raise PayloadTooLarge(f"Image exceeds {self.max_bytes} bytes")
+        return bytes(self.output)
+
+
+class JsonImageParser:
+    """
+    Parses a JSON object fed in chunks, streaming image_field through a
+    Base64Decoder and collecting every other top-level field as a value.
+
+    Other fields are limited to max_field_bytes each, since only the image is
+    expected to be large.
+    """
+
+    def __init__(self, image_field="image_base64", max_image_bytes=10 * 1024 * 1024, max_field_bytes=64 * 1024):
+        self.image_field = image_field.encode()
+        self.max_field_bytes = max_field_bytes
+        self.decoder = Base64Decoder(max_image_bytes)
+        self.fields = {}
+        self.has_image = False
+        self._state = "start"
+        self._key = None
+        self._raw = bytearray()
+        self._carry = b""
+        # Nesting state while skipping over a non-string value.
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        data = self._carry + chunk if self._carry else chunk
+        self._carry = b""
+        i = 0
+        n = len(data)
+        while i < n:
+            state = self._state
+            if state in ("key", "string", "image"):
+                i = self._feed_string(data, i)
+                continue
+            if state == "value":
+                i = self._feed_value(data, i)
+                continue
+
+            c = data[i]
+            i += 1
+            if c in _WHITESPACE:
+                continue
+            if state == "start" and c == ord("{"):
+                self._state = "first_key"
+            elif state in ("first_key", "next_key") and c == ord('"'):
+                self._state = "key"
+            elif state == "first_key" and c == ord("}"):
+                self._state = "done"
+            elif state == "colon" and c == ord(":"):
+                self._state = "value_start"
+            elif state == "value_start":
+                if c == ord('"'):
+                    self._state = "image" if self._key == self.image_field else "string"
+                else:
+                    self._state = "value"
+                    i -= 1
+            elif state == "after_value" and c == ord(","):
+                self._state = "next_key"
+            elif state == "after_value" and c == ord("}"):
+                self._state = "done"
+            else:
+                raise InvalidBodyError(f"Invalid JSON body: unexpected {chr(c)!r}")
+
+    def _feed_string(self, data, i):
+        """
+        Consume string content up to the closing quote or the end of data.
+        """
+        quote = data.find(b'"', i)
+        backslash = data.find(b"\\", i, len(data) if quote == -1 else quote)
+        end = backslash if backslash != -1 else quote
+        if end == -1:
+            self._string_part(data[i:])
+            return len(data)
+        self._string_part(data[i:end])
+        if data[end] == ord('"'):
+            self._close_string()
+            return end + 1
+
+        # A backslash escape, which may be cut off by the end of the chunk.
+        size = 6 if data[end + 1:end + 2] == b"u" else 2
+        if end + size > len(data):
+            self._carry = data[end:]
+            return len(data)
+        escape = data[end:end + size]
+        if self._state == "image":
+            # Only "\/" is a base64 character; escaped whitespace is dropped by the decoder.
+            try:
+                self.decoder.feed(json.loads(b'"' + escape + b'"').encode())
+            except ValueError as e:
+                raise InvalidBodyError(f"Invalid JSON body: {e}") from None
+        else:
+            self._string_part(escape)
+        return end + size
+
+    def _string_part(self, part):
+        if self._state == "image":
+            self.decoder.feed(part)
+            return
+        if len(self._raw) + len(part) > self.max_field_bytes:
+            raise PayloadTooLarge(f"JSON field exceeds {self.max_field_bytes} bytes")
+        self._raw += part
+
+    def _close_string(self):
+        state = self._state
+        if state == "image":
+            self.has_image = True
+            self._state = "after_value"
+            return
+        try:
+            value = json.loads(b'"' + self._raw + b'"')
+        except ValueError as e:
+            raise InvalidBodyError(f"Invalid JSON body: {e}") from None
+        self._raw.clear()
+        if state == "key":
+            self._key = value.encode()
+            self._state = "colon"
+        else:
+            self.fields[self._key.decode()] = value
+            self._state = "after_value"
+
+    def _feed_value(self, data, i):
+        """
+        Collect a non-string value (number, literal, array or object) up to the
+        comma or brace that ends it.
+        """
+        start = i
+        n = len(data)
+        while i < n:
+            c = data[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == ord("\\"):
+                    self._escaped = True
+                elif c == ord('"'):
+                    self._in_string = False
+            elif c == ord('"'):
+                self._in_string = True
+            elif c in b"[{":
+                self._depth += 1
+            elif c in b"]}" and self._depth > 0:
+                self._depth -= 1
+            elif self._depth == 0 and c in b",}":
+                self._string_part(data[start:i])
+                try:
+                    value = json.loads(bytes(self._raw))
+                except ValueError as e:
+                    raise InvalidBodyError(f"Invalid JSON body: {e}") from None
+                self._raw.clear()
+                self.fields[self._key.decode()] = value
+                self._state = "after_value"
+                # The comma or brace is handled by the structural states.
+                return i
+            i += 1
+        self._string_part(data[start:i])
+        return i
+
+    def finish(self):
+        """
+        Return (image_bytes, fields) once the whole body has been fed.
+        image_bytes is None when the body had no image field.
+        """
+        if self._state != "done":
+            raise InvalidBodyError("Invalid JSON body: unexpected end of data")
+        return (self.decoder.finish() if self.has_image else None), self.fields
@@ -0,0 +1,120 @@
+"""
+Load test for the /predict_json endpoint.
+
+Runs the FastAPI app in-process with a slow stand-in for the Gemini model and
+fires concurrent requests at it. If the model call blocks the event loop the
+requests run one after another; with the executor path they overlap.
+
+Usage:
+    python loadtest.py --requests 8 --delay 1.0
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import sys
+import time
+
+import httpx
+from PIL import Image
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("RATE_LIMITS", "")
+os.environ.setdefault("PREDICTION_STORE_PATH", "")
+
+import server  # noqa: E402
+from backends import GeminiBackend  # noqa: E402
+
+FAKE_PREDICTION = {
+    "top_3_possible_diseases": [
+        {"name": "Eczema", "confidence": 60},
+        {"name": "Psoriasis", "confidence": 30},
+        {"name": "Dermatitis", "confidence": 10},
+    ],
+    "explanation": "Load test response.",
+    "urgency": "Low",
+    "recommended_next_steps": ["Step 1", "Step 2", "Step 3"],
+    "disclaimer": "This is an AI-based suggestion, not a medical diagnosis.",
+}
+
+
+class SlowResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class SlowModel:
+    """
+    Blocking stand-in for genai.GenerativeModel that sleeps like a real model call.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def generate_content(self, contents, request_options=None):
+        time.sleep(self.delay)
+        return SlowResponse(json.dumps(FAKE_PREDICTION))
+
+
+async def run(num_requests, delay, max_workers):
+    server.backend = GeminiBackend(SlowModel(delay), max_workers=max_workers)
+
+    image = io.BytesIO()
+    Image.new("RGB", (400, 300), (200, 120, 110)).save(image, format="JPEG")
+    image_base64 = base64.b64encode(image.getvalue()).decode()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        async def predict(i):
+            # Distinct symptoms so requests are not served from the cache or coalesced.
+            payload = {"symptoms": f"itchy red patches #{i}", "image_base64": image_base64}
+            response = await client.post("/predict_json", json=payload)
+            response.raise_for_status()
+
+        async def probe():
+            # A cheap request issued while predictions are in flight; it should not wait for them.
+            await asyncio.sleep(delay / 10)
+            start = time.perf_counter()
+            response = await client.get("/openapi.json")
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(probe(), *(predict(i) for i in range(num_requests)))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, results[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=8, help="number of concurrent /predict_json requests")
+    parser.add_argument("--delay", type=float, default=1.0, help="simulated model latency in seconds")
+    parser.add_argument("--workers", type=int, default=8, help="Gemini executor size")
+    args = parser.parse_args()
+
+    elapsed, probe_latency = asyncio.run(run(args.requests, args.delay, args.workers))
+    serial = args.requests * args.delay
+    batches = -(-args.requests // args.workers)
+    expected = batches * args.delay
+
+    print(f"requests:        {args.requests}")
+    print(f"model delay:     {args.delay:.2f}s")
+    print(f"executor size:   {args.workers}")
+    print(f"wall time:       {elapsed:.2f}s (serial would be {serial:.2f}s, overlapped ~{expected:.2f}s)")
+    print(f"probe latency:   {probe_latency * 1000:.1f}ms")
+
+    # Allow generous slack for scheduling, but fail if requests ran one after another.
+    if args.requests > 1 and elapsed >= expected + (serial - expected) / 2:
+        print("FAIL: requests did not overlap")
+        sys.exit(1)
+    if probe_latency >= args.delay:
+        print("FAIL: event loop was blocked while predictions were in flight")
+        sys.exit(1)
+    print("OK: requests overlapped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Structured JSON logging for the server.
+
+Records are handed to a queue on the request path and written to stdout by a
+background listener thread, so logging never blocks on I/O. The queue itself
+is unbounded; the handler caps it at LOG_QUEUE_SIZE records. When the writer
+falls behind, records below ERROR are dropped once 90% of that is in use, which
+leaves the rest for errors, and errors are dropped once all of it is. Dropped
+records are counted.
+
+Configuration:
+    LOG_LEVEL              minimum level to emit (default INFO; ERROR silences
+                           everything but errors)
+    LOG_QUEUE_SIZE         records buffered before errors are dropped too
+                           (default 10000); records below ERROR are dropped
+                           once 90% of it is in use
+    LOG_RAW_SAMPLE_RATE    fraction of successful requests whose raw model
+                           output is logged (default 0.01)
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_RAW_SAMPLE_RATE = float(os.getenv("LOG_RAW_SAMPLE_RATE", "0.01"))
+
+# Attributes every LogRecord has; anything else was passed through extra=.
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "request_id"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.request_id:
+            entry["request_id"] = record.request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the caller.
+
+    The queue itself is unbounded; capacity is enforced here. Records below
+    ERROR may only fill it to (1 - reserved) of capacity, so the rest is kept
+    for errors, which are what matter most when the writer falls behind.
+    Records that do not fit are counted in dropped.
+    """
+
+    def __init__(self, log_queue, capacity=10_000, reserved=0.1):
+        super().__init__(log_queue)
+        self.capacity = capacity
+        self.low_capacity = int(capacity * (1 - reserved))
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Runs in the caller's thread, where the request's context is still available.
+        record.request_id = request_id_var.get()
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        limit = self.capacity if record.levelno >= logging.ERROR else self.low_capacity
+        # qsize() is approximate across threads, which only blurs the limit by a record or two.
+        if self.queue.qsize() >= limit:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+_listener = None
+logger = logging.getLogger("afiyahmed")
+
+
+def setup_logging():
+    """
+    Route the "afiyahmed" logger through the queue to a JSON stdout writer.
+    """
+    global _listener
+    if _listener is not None:
+        return logger
+
+    log_queue = queue.Queue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    logger.handlers = [DroppingQueueHandler(log_queue, LOG_QUEUE_SIZE)]
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return logger
+
+
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records():
+    return sum(getattr(handler, "dropped", 0) for handler in logger.handlers)
+
+
+def sample_raw():
+    """
+    Whether this request's raw model output should be logged.
+    """
+    return LOG_RAW_SAMPLE_RATE > 0 and random.random() < LOG_RAW_SAMPLE_RATE and logger.isEnabledFor(logging.INFO)
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that tags each request with an ID for its log records.
+
+    Reuses the client's X-Request-ID when present and echoes the ID back in the
+    response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        if not request_id:
+            request_id = uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            logger.debug(
+                "request finished",
+                extra={"path": scope["path"], "duration_ms": round((time.perf_counter() - start) * 1000, 2)},
+            )
+            request_id_var.reset(token)
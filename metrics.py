@@ -0,0 +1,224 @@
+"""
+Prometheus metrics for the prediction path, served from /metrics.
+
+Stage histograms are bound to their label once at import so the hot path only
+pays for a clock read and a bucket increment per stage.
+"""
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, REGISTRY
+
+# Stages of a prediction, in the order they run.
+STAGE_NAMES = ("decode", "fingerprint", "prompt", "normalize", "model", "parse", "serialize")
+
+# Sub-millisecond buckets for the CPU stages up to a minute for the model call.
+STAGE_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0,
+)
+
+STAGE_SECONDS = Histogram(
+    "afiyahmed_stage_seconds",
+    "Time spent in each stage of a prediction request.",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STAGES = {name: STAGE_SECONDS.labels(name) for name in STAGE_NAMES}
+
+PREDICTIONS = Counter(
+    "afiyahmed_predictions",
+    "Prediction requests by outcome.",
+    ["outcome"],
+)
+# parsed: model answer parsed; parse_failed: canned fallback returned;
+# upstream_error: the model call failed; cached: served from the result cache;
+# invalid_image: upload could not be decoded; rejected: turned away by
+# admission control; degraded: canned answer while the circuit breaker is
+# open; near_duplicate: served the cached answer for a near-identical photo;
+# error: anything else.
+OUTCOMES = {
+    name: PREDICTIONS.labels(name)
+    for name in (
+        "parsed", "parse_failed", "upstream_error", "cached", "near_duplicate",
+        "invalid_image", "rejected", "degraded", "error",
+    )
+}
+
+PARSE_PATH = Counter(
+    "afiyahmed_parse_path",
+    "Model responses by how they were parsed.",
+    ["path"],
+)
+# schema: valid structured JSON as returned; scraped: recovered by stripping
+# code fences/extra text; failed: unusable, the fallback response was returned.
+PARSE_PATHS = {name: PARSE_PATH.labels(name) for name in ("schema", "scraped", "failed")}
+
+PROMPT_RESULTS = Counter(
+    "afiyahmed_prompt_results",
+    "Model answers by prompt version and whether they parsed, for comparing prompt versions.",
+    ["version", "result"],
+)
+
+STREAM_FIRST_EVENT = Histogram(
+    "afiyahmed_stream_first_event_seconds",
+    "Time from starting the model stream to the first field event on /predict_stream.",
+    buckets=STAGE_BUCKETS,
+)
+
+IN_FLIGHT = Gauge(
+    "afiyahmed_predictions_in_flight",
+    "Prediction requests currently being handled.",
+)
+
+ADMISSION_ACTIVE = Gauge(
+    "afiyahmed_admission_active",
+    "Model calls currently holding an admission slot.",
+)
+ADMISSION_WAITING = Gauge(
+    "afiyahmed_admission_queue_depth",
+    "Requests waiting for an admission slot.",
+)
+ADMISSION_REJECTION = Counter(
+    "afiyahmed_admission_rejected",
+    "Requests rejected by admission control.",
+    ["reason"],
+)
+ADMISSION_REJECTED = {name: ADMISSION_REJECTION.labels(name) for name in ("queue_full", "timeout")}
+
+JOBS_QUEUED = Gauge(
+    "afiyahmed_jobs_queued",
+    "Jobs waiting for a worker.",
+)
+JOBS_REJECTED = Counter(
+    "afiyahmed_jobs_rejected",
+    "Job submissions rejected because the queue was full.",
+)
+
+BACKEND_READY = Gauge(
+    "afiyahmed_backend_ready",
+    "1 once the inference backend has started and the server reports ready.",
+)
+
+CIRCUIT_STATE = Gauge(
+    "afiyahmed_circuit_state",
+    "Circuit breaker state around the model backend: 0 closed, 1 half-open, 2 open.",
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "afiyahmed_circuit_transitions",
+    "Circuit breaker state changes, by the state entered.",
+    ["state"],
+)
+
+MODEL_RETRY_EVENT = Counter(
+    "afiyahmed_model_retry_events",
+    "Extra model attempts: retry after a retryable error, hedge started, hedge answered first.",
+    ["kind"],
+)
+MODEL_RETRY_EVENTS = {name: MODEL_RETRY_EVENT.labels(name) for name in ("retry", "hedge", "hedge_won")}
+
+CANCEL = Counter(
+    "afiyahmed_cancelled_requests",
+    "Requests whose work was abandoned: the client disconnected or the deadline passed.",
+    ["reason"],
+)
+CANCELLED = {name: CANCEL.labels(name) for name in ("disconnect", "deadline")}
+
+BATCH_SIZE = Histogram(
+    "afiyahmed_model_batch_size",
+    "Items per micro-batched model call.",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32),
+)
+BATCH_QUEUE_DELAY = Histogram(
+    "afiyahmed_model_batch_queue_seconds",
+    "Time a model call waited for its micro-batch window to close.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.25),
+)
+
+
+def observe_batch(size, queue_delays):
+    BATCH_SIZE.observe(size)
+    for delay in queue_delays:
+        BATCH_QUEUE_DELAY.observe(delay)
+
+
+MODEL_TOKEN = Counter(
+    "afiyahmed_model_tokens",
+    "Tokens reported by the model: prompt (including cached), cached (served from upstream context cache), output.",
+    ["kind"],
+)
+MODEL_TOKENS = {
+    key: MODEL_TOKEN.labels(kind)
+    for key, kind in (("prompt_tokens", "prompt"), ("cached_tokens", "cached"), ("output_tokens", "output"))
+}
+
+
+RATE_LIMITED = Counter(
+    "afiyahmed_rate_limited",
+    "Requests rejected by the per-client rate limiter.",
+    ["route"],
+)
+
+
+class StatsCollector:
+    """
+    Exports counters that other components already keep (cache, single-flight)
+    at scrape time, so the hot path does not update them twice.
+    """
+
+    def __init__(self, stats_fn):
+        self.stats_fn = stats_fn
+
+    def collect(self):
+        stats = self.stats_fn()
+        for name in ("hits", "misses", "evictions"):
+            counter = CounterMetricFamily(f"afiyahmed_cache_{name}", f"Prediction cache {name}.")
+            counter.add_metric([], stats[name])
+            yield counter
+        for name in ("entries", "bytes"):
+            gauge = GaugeMetricFamily(f"afiyahmed_cache_{name}", f"Prediction cache {name}.")
+            gauge.add_metric([], stats[name])
+            yield gauge
+
+        coalesced = CounterMetricFamily(
+            "afiyahmed_coalesced_requests", "Requests that waited on an identical in-flight model call."
+        )
+        coalesced.add_metric([], stats["coalesced"])
+        yield coalesced
+        abandoned = CounterMetricFamily(
+            "afiyahmed_abandoned_model_calls", "Model calls cancelled because every request waiting on them went away."
+        )
+        abandoned.add_metric([], stats["abandoned"])
+        yield abandoned
+        near_duplicates = GaugeMetricFamily(
+            "afiyahmed_near_duplicate_entries", "Image fingerprints in the near-duplicate index."
+        )
+        near_duplicates.add_metric([], stats["near_duplicate_entries"])
+        yield near_duplicates
+        for name, found in (("hits", "found a match"), ("misses", "found no match")):
+            counter = CounterMetricFamily(
+                f"afiyahmed_near_duplicate_{name}", f"Near-duplicate index lookups that {found}."
+            )
+            counter.add_metric([], stats[f"near_duplicate_{name}"])
+            yield counter
+        for name in ("hits", "misses", "writes", "bytes_written", "compactions"):
+            counter = CounterMetricFamily(f"afiyahmed_store_{name}", f"Persistent prediction store {name.replace('_', ' ')}.")
+            counter.add_metric([], stats[f"store_{name}"])
+            yield counter
+        store_file = GaugeMetricFamily("afiyahmed_store_file_bytes", "Persistent prediction store size on disk.")
+        store_file.add_metric([], stats["store_file_bytes"])
+        yield store_file
+        model_in_flight = GaugeMetricFamily("afiyahmed_model_calls_in_flight", "Distinct model calls in flight.")
+        model_in_flight.add_metric([], stats["in_flight"])
+        yield model_in_flight
+        dropped = CounterMetricFamily(
+            "afiyahmed_log_records_dropped", "Log records dropped because the log queue was full."
+        )
+        dropped.add_metric([], stats["log_records_dropped"])
+        yield dropped
+
+
+def register_stats(stats_fn):
+    REGISTRY.register(StatsCollector(stats_fn))
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
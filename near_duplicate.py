@@ -0,0 +1,173 @@
+import itertools
+import math
+from collections import deque
+
+
+def _within(bits, radius):
+    """
+    Number of bit strings of length bits within radius flips of a given one.
+    """
+    return sum(math.comb(bits, r) for r in range(radius + 1))
+
+
+def choose_chunks(bits, max_distance, max_entries):
+    """
+    Pick how many substrings to split hashes into for the cheapest expected lookup:
+    slots probed, plus candidates found in them when the index is full.
+    """
+    best, best_cost = 1, math.inf
+    for chunks in range(1, min(bits, max_distance + 1) + 1):
+        width = bits // chunks
+        probes = _within(width, max_distance // chunks)
+        cost = chunks * probes * (1 + 3 * max_entries / 2 ** width)
+        if cost < best_cost:
+            best, best_cost = chunks, cost
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Finds stored image hashes within a Hamming distance of a query hash.
+
+    Multi-index hashing: each hash is split into substrings, each with its own
+    table. If two hashes differ in at most max_distance bits, some substring
+    differs in at most max_distance // chunks bits (pigeonhole), so a lookup only
+    probes the table slots that close to the query's substrings and checks the
+    candidates found there. The number of substrings is chosen from
+    max_distance and max_entries so lookups stay well under a millisecond with
+    millions of entries.
+
+    Entries carry a group (the normalized symptoms and prompt version), a
+    value (the prediction cache key) and a larger check hash; only entries in
+    the query's group whose check hash is also within check_distance bits
+    match. The oldest entries are dropped beyond max_entries.
+
+    Hashes with fewer than min_bits set bits, or fewer than min_bits clear
+    ones, are never indexed or matched: low-contrast and smooth photos hash to
+    nearly all zeros whatever they show, so their distance says nothing.
+    """
+
+    def __init__(self, max_distance=2, max_entries=100_000, bits=64, check_distance=8, min_bits=8):
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.bits = bits
+        self.check_distance = check_distance
+        self.min_bits = min_bits
+        self.chunks = choose_chunks(bits, max_distance, max_entries)
+        # Substring (shift, mask) pairs; the last one takes any leftover bits.
+        width = bits // self.chunks
+        self._layout = [
+            (i * width, (1 << (width if i < self.chunks - 1 else bits - i * width)) - 1)
+            for i in range(self.chunks)
+        ]
+        radius = max_distance // self.chunks
+        # XOR masks reaching every substring within `radius` bits of a given one.
+        self._probes = [
+            [sum(1 << bit for bit in flipped)
+             for r in range(radius + 1)
+             for flipped in itertools.combinations(range(mask.bit_length()), r)]
+            for _, mask in self._layout
+        ]
+        self._tables = [{} for _ in range(self.chunks)]
+        self._entries = {}
+        self._by_value = {}
+        self._order = deque()
+        self._next_id = 0
+        self._stale = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def informative(self, image_hash):
+        return self.min_bits <= image_hash.bit_count() <= self.bits - self.min_bits
+
+    def _index(self, entry_id, image_hash):
+        for table, (shift, mask) in zip(self._tables, self._layout):
+            substring = image_hash >> shift & mask
+            # Most slots hold a single entry, so a bare ID saves a list per slot.
+            slot = table.get(substring)
+            if slot is None:
+                table[substring] = entry_id
+            elif isinstance(slot, list):
+                slot.append(entry_id)
+            else:
+                table[substring] = [slot, entry_id]
+
+    def add(self, image_hash, check_hash, group, value):
+        if value in self._by_value or not self.informative(image_hash):
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (image_hash, check_hash, group, value)
+        self._by_value[value] = entry_id
+        self._order.append(entry_id)
+        self._index(entry_id, image_hash)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(self._order.popleft())
+
+    def discard(self, value):
+        """
+        Forget the entry for value, e.g. once its cached prediction is gone.
+        """
+        entry_id = self._by_value.get(value)
+        if entry_id is not None:
+            self._remove(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        del self._by_value[entry[3]]
+        # Table slots keep the dead ID until the next rebuild.
+        self._stale += 1
+        if self._stale > max(len(self._entries), 1024):
+            self._rebuild()
+
+    def _rebuild(self):
+        self._tables = [{} for _ in range(self.chunks)]
+        for entry_id, (image_hash, _, _, _) in self._entries.items():
+            self._index(entry_id, image_hash)
+        self._order = deque(entry_id for entry_id in self._order if entry_id in self._entries)
+        self._stale = 0
+
+    def lookup(self, image_hash, check_hash, group):
+        """
+        Return (value, distance) of the closest matching entry in group within max_distance, or None.
+        """
+        if not self.informative(image_hash):
+            self.misses += 1
+            return None
+        best = None
+        best_distance = self.max_distance + 1
+        entries = self._entries
+        for table, (shift, mask), probes in zip(self._tables, self._layout, self._probes):
+            substring = image_hash >> shift & mask
+            for probe in probes:
+                slot = table.get(substring ^ probe)
+                if slot is None:
+                    continue
+                for entry_id in (slot if isinstance(slot, list) else (slot,)):
+                    entry = entries.get(entry_id)
+                    if entry is None or entry[2] != group:
+                        continue
+                    distance = (entry[0] ^ image_hash).bit_count()
+                    if distance < best_distance and (entry[1] ^ check_hash).bit_count() <= self.check_distance:
+                        best, best_distance = entry[3], distance
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return best, best_distance
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "max_distance": self.max_distance,
+            "chunks": self.chunks,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
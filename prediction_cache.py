@@ -0,0 +1,115 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+import json_codec
+
+
+def normalize_symptoms(symptoms):
+    """
+    Normalize symptom text so trivially different submissions share a cache key.
+    """
+    return " ".join(symptoms.lower().split())
+
+
+def image_digest(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def make_cache_key(digest, symptoms, prompt_version):
+    """
+    Build a content-addressed key from the image digest, normalized symptoms and prompt version.
+    """
+    material = f"{prompt_version}\0{digest}\0{normalize_symptoms(symptoms)}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def symptoms_key(symptoms, prompt_version):
+    """
+    Short key for the normalized symptoms and prompt version, independent of the image.
+    """
+    material = f"{prompt_version}\0{normalize_symptoms(symptoms)}"
+    return hashlib.sha256(material.encode("utf-8")).digest()[:16]
+
+
+class PredictionCache:
+    """
+    In-memory LRU cache of parsed predictions with a TTL and a memory cap.
+
+    Entry size is estimated from the serialized prediction, which is close enough
+    to keep the cache bounded without walking Python object graphs.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, size, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """
+        Cache value for ttl seconds, or the cache's own TTL if that is shorter or ttl is None.
+        """
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if self.max_entries <= 0 or ttl <= 0:
+            return
+
+        size = len(key) + len(json_codec.dumps(value))
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (value, size, time.monotonic() + ttl)
+        self.current_bytes += size
+
+        while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
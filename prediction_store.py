@@ -0,0 +1,151 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import json_codec
+
+
+class PredictionStore:
+    """
+    Parsed predictions kept in a SQLite file so they survive restarts.
+
+    Keys are the hex cache keys from make_cache_key, stored as their 32 raw
+    bytes. Rows are appended in rowid order, so a write touches the last table
+    page and one leaf of the key index rather than a random page of a table
+    clustered on the key, and rowid order doubles as age order for warm-up and
+    trimming. The file is in WAL mode, so every worker process on the host can
+    share it and readers never wait on the writer. All calls run on a single
+    background thread so the event loop never touches the file.
+
+    Entries older than ttl seconds are ignored on read and deleted by
+    compact(), which also trims the store to max_entries and returns the freed
+    pages to the filesystem.
+    """
+
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=100_000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        try:
+            # Only takes effect when the file is created; lets compact() shrink it without a full VACUUM.
+            self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS predictions (key BLOB NOT NULL UNIQUE, value BLOB NOT NULL, created REAL NOT NULL)"
+            )
+        except sqlite3.Error:
+            self.conn.close()
+            raise
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prediction-store")
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        # Key and value bytes handed to SQLite, to compare against what reaches the disk.
+        self.bytes_written = 0
+        self.compactions = 0
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _get(self, key):
+        # Wall-clock time, since monotonic clocks are not comparable across processes or restarts.
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT value, created FROM predictions WHERE key = ? AND created > ?", (bytes.fromhex(key), now - self.ttl)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json_codec.loads(row[0]), now - row[1]
+
+    async def get(self, key):
+        """
+        The unexpired (prediction, age_seconds) stored for key, or None.
+        """
+        return await self._run(self._get, key)
+
+    def _put(self, key, value):
+        key = bytes.fromhex(key)
+        data = json_codec.dumps(value)
+        # REPLACE deletes any older row first, so the new one gets the highest rowid.
+        self.conn.execute(
+            "INSERT OR REPLACE INTO predictions (key, value, created) VALUES (?, ?, ?)", (key, data, time.time())
+        )
+        self.writes += 1
+        self.bytes_written += len(key) + len(data)
+
+    async def put(self, key, value):
+        await self._run(self._put, key, value)
+
+    def _recent(self, limit):
+        now = time.time()
+        rows = self.conn.execute(
+            "SELECT key, value, created FROM predictions WHERE created > ? ORDER BY rowid DESC LIMIT ?",
+            (now - self.ttl, limit),
+        ).fetchall()
+        return [(key.hex(), json_codec.loads(value), now - created) for key, value, created in rows]
+
+    async def recent(self, limit):
+        """
+        Up to limit unexpired (key, prediction, age_seconds) entries, newest first.
+        """
+        return await self._run(self._recent, limit)
+
+    def _compact(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            expired = self.conn.execute(
+                "DELETE FROM predictions WHERE created <= ?", (time.time() - self.ttl,)
+            ).rowcount
+            trimmed = self.conn.execute(
+                "DELETE FROM predictions WHERE rowid IN "
+                "(SELECT rowid FROM predictions ORDER BY rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        # execute() would step this pragma once and free a single page; executescript runs it to completion.
+        self.conn.executescript("PRAGMA incremental_vacuum;")
+        # Copy the log into the main file and truncate it, so the WAL does not grow without bound.
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compactions += 1
+        return expired + trimmed
+
+    async def compact(self):
+        """
+        Delete expired and excess entries and shrink the files. Returns the number of entries removed.
+        """
+        return await self._run(self._compact)
+
+    def file_bytes(self):
+        """
+        Size of the database and its write-ahead log on disk.
+        """
+        total = 0
+        for path in (self.path, self.path + "-wal"):
+            try:
+                total += os.path.getsize(path)
+            except OSError:
+                pass
+        return total
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "bytes_written": self.bytes_written,
+            "file_bytes": self.file_bytes(),
+            "compactions": self.compactions,
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.conn.close()
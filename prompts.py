@@ -0,0 +1,183 @@
+"""
+Versioned prompt templates, compiled once at startup.
+
+Each version lives in PROMPT_DIR as <version>.txt, with an optional
+<version>.batch.txt for micro-batched calls. Templates use $name placeholders:
+$symptoms in the single-case template, $count and $cases in the batch one.
+Write $$ for a literal dollar sign.
+
+A version may also have a <version>.system.txt: a static instruction block,
+with no placeholders, sent ahead of the single-case prompt. Backends that
+support it cache this block upstream so it is not re-sent with every call.
+
+Templates are split into literal text and placeholders when they are loaded,
+so building a prompt is one join, and only sanitized symptom text is ever
+interpolated.
+"""
+import hashlib
+import os
+from string import Template
+
+SINGLE_FIELDS = frozenset({"symptoms"})
+BATCH_FIELDS = frozenset({"count", "cases"})
+
+
+def sanitize_symptoms(symptoms, max_chars=2000):
+    """
+    Symptom text as it may appear in a prompt: control and other non-printable
+    characters become spaces, whitespace runs collapse to one space, and the
+    result is cut to max_chars.
+    """
+    if symptoms.isprintable():
+        # The common case: nothing to replace, and usually nothing to collapse either.
+        if "  " not in symptoms and symptoms[:1] != " " and symptoms[-1:] != " ":
+            return symptoms[:max_chars]
+    else:
+        symptoms = "".join(ch if ch.isprintable() else " " for ch in symptoms)
+    return " ".join(symptoms.split())[:max_chars]
+
+
+class PromptTemplate:
+    """
+    A template pre-split into literal text and placeholder names.
+    """
+
+    def __init__(self, text, allowed_fields):
+        self.literals = []
+        self.fields = []
+        current = []
+        last = 0
+        for match in Template.pattern.finditer(text):
+            current.append(text[last:match.start()])
+            last = match.end()
+            if match.group("escaped") is not None:
+                current.append("$")
+                continue
+            name = match.group("named") or match.group("braced")
+            if name is None:
+                raise ValueError(f"Invalid placeholder at offset {match.start()}")
+            if name not in allowed_fields:
+                raise ValueError(f"Unknown placeholder ${name}, expected one of {sorted(allowed_fields)}")
+            self.literals.append("".join(current))
+            self.fields.append(name)
+            current = []
+        current.append(text[last:])
+        self.literals.append("".join(current))
+
+    def render(self, values):
+        parts = [self.literals[0]]
+        for name, literal in zip(self.fields, self.literals[1:]):
+            parts.append(values[name])
+            parts.append(literal)
+        return "".join(parts)
+
+
+class PromptVersion:
+    """
+    The compiled templates for one prompt version.
+    """
+
+    def __init__(self, version, single, batch=None, system=None, max_symptom_chars=2000):
+        self.version = version
+        self.single = single
+        self.batch = batch
+        # The static instruction block as plain text, or None.
+        self.system = system
+        self.max_symptom_chars = max_symptom_chars
+
+    def build(self, symptoms):
+        return self.single.render({"symptoms": sanitize_symptoms(symptoms, self.max_symptom_chars)})
+
+    def build_batch(self, symptoms_list):
+        """
+        The prompt for several cases answered in one call, or None if this version has no batch template.
+        """
+        if self.batch is None:
+            return None
+        cases = "\n".join(
+            f"Case {number}: {sanitize_symptoms(symptoms, self.max_symptom_chars)}"
+            for number, symptoms in enumerate(symptoms_list, 1)
+        )
+        return self.batch.render({"count": str(len(symptoms_list)), "cases": cases})
+
+
+def parse_rollout(spec):
+    """
+    Parse "v1" or "v1=90,v2=10" into a list of (version, weight).
+    """
+    rollout = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        version, _, weight = item.partition("=")
+        try:
+            weight = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Invalid prompt rollout entry {item!r}, expected VERSION or VERSION=WEIGHT") from None
+        if weight < 0:
+            raise ValueError(f"Invalid prompt rollout entry {item!r}, weight must not be negative")
+        rollout.append((version.strip(), weight))
+    if not rollout or sum(weight for _, weight in rollout) <= 0:
+        raise ValueError(f"Invalid prompt rollout {spec!r}, expected at least one version with a positive weight")
+    return rollout
+
+
+class PromptRegistry:
+    """
+    Prompt versions by ID, and the rollout that decides which one a request gets.
+
+    select() is deterministic in the image digest, so the same image always
+    gets the same version, stays cacheable, and retries do not switch arms of
+    an A/B test.
+    """
+
+    def __init__(self, versions, rollout):
+        self.versions = versions
+        for version, _ in rollout:
+            if version not in versions:
+                raise ValueError(f"Prompt version {version!r} is not defined, expected one of {sorted(versions)}")
+        self.rollout = [(versions[version], weight) for version, weight in rollout if weight > 0]
+        self.total_weight = sum(weight for _, weight in self.rollout)
+
+    @classmethod
+    def load(cls, directory, rollout, max_symptom_chars=2000):
+        versions = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".txt") or name.endswith((".batch.txt", ".system.txt")):
+                continue
+            version = name[:-len(".txt")]
+            single = PromptTemplate(read_template(os.path.join(directory, name)), SINGLE_FIELDS)
+            if "symptoms" not in single.fields:
+                raise ValueError(f"Prompt {name} does not use $symptoms")
+            batch = None
+            batch_path = os.path.join(directory, f"{version}.batch.txt")
+            if os.path.exists(batch_path):
+                batch = PromptTemplate(read_template(batch_path), BATCH_FIELDS)
+            system = None
+            system_path = os.path.join(directory, f"{version}.system.txt")
+            if os.path.exists(system_path):
+                system = PromptTemplate(read_template(system_path), frozenset()).render({})
+            versions[version] = PromptVersion(version, single, batch, system, max_symptom_chars)
+        return cls(versions, rollout)
+
+    def select(self, digest):
+        """
+        The version for an image, by its hex digest.
+        """
+        if len(self.rollout) == 1:
+            return self.rollout[0][0]
+        # Mixed with a fixed label so the split is independent of other uses of the digest.
+        point = int(hashlib.sha256(b"prompt-rollout\0" + digest.encode()).hexdigest()[:15], 16) / 16 ** 15
+        point *= self.total_weight
+        for version, weight in self.rollout:
+            if point < weight:
+                return version
+            point -= weight
+        return self.rollout[-1][0]
+
+
+def read_template(path):
+    with open(path, encoding="utf-8") as f:
+        # Editors add a trailing newline the prompt never had.
+        return f.read().rstrip("\n")
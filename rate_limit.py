@@ -0,0 +1,260 @@
+"""
+Per-client token-bucket rate limiting.
+
+Each (route, client) pair gets a bucket holding up to `limit` tokens that
+refills at limit/period tokens per second; a request costs one token. Clients
+are identified by a known API key (X-API-Key) or otherwise by IP address.
+
+Behind a load balancer every request arrives from the balancer's address, so
+peers listed as trusted proxies are looked through: the client is the last
+X-Forwarded-For entry not added by a trusted proxy. With "*" any peer is
+trusted, but only as a single hop, so the client is the last entry, the one
+the balancer appended itself; earlier entries come from the client and could
+be forged.
+
+Stores:
+    MemoryStore   per-process dict; fastest, but every worker has its own limits
+    SQLiteStore   shared file in WAL mode so all workers on a host share limits
+"""
+import asyncio
+import ipaddress
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Limit:
+    def __init__(self, limit, period):
+        self.limit = limit
+        self.period = period
+        self.rate = limit / period
+
+
+def parse_limits(spec):
+    """
+    Parse "ROUTE=LIMIT/SECONDS,..." such as "/predict_json=30/60" into {route: Limit}.
+    """
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        route, _, value = item.partition("=")
+        limit, _, period = value.partition("/")
+        try:
+            limits[route.strip()] = Limit(int(limit), float(period))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit {item!r}, expected ROUTE=LIMIT/SECONDS") from None
+    return limits
+
+
+def parse_trusted_proxies(spec):
+    """
+    Parse "*" or a comma-separated list of addresses and CIDR networks into "*" or a list of networks.
+    """
+    spec = spec.strip()
+    if spec == "*":
+        return "*"
+    networks = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            raise ValueError(f"Invalid trusted proxy {item!r}, expected an IP address or CIDR network") from None
+    return networks
+
+
+def refill(tokens, updated, now, limit):
+    return min(limit.limit, tokens + (now - updated) * limit.rate)
+
+
+def take_token(tokens, limit):
+    """
+    Spend one token if there is one. Returns (allowed, tokens_left, retry_after).
+    """
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) / limit.rate
+
+
+class MemoryStore:
+    """
+    In-process buckets. Idle buckets are evicted LRU-first past max_keys.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key, limit):
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (limit.limit, now))
+        allowed, tokens, retry_after = take_token(refill(tokens, updated, now, limit), limit)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens, retry_after
+
+    def close(self):
+        pass
+
+
+class SQLiteStore:
+    """
+    Buckets in a SQLite file shared by every worker process on the host.
+
+    Each take is one short IMMEDIATE transaction, run on a single background
+    thread so the event loop never waits on the file lock. At most every
+    prune_interval seconds, buckets idle for longer than the longest period
+    seen are deleted: they have refilled completely, so a missing row means
+    the same thing.
+    """
+
+    def __init__(self, path, prune_interval=60.0):
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ratelimit")
+        self.prune_interval = prune_interval
+        self._max_period = 0.0
+        self._pruned_at = time.time()
+
+    def _prune(self, now):
+        self._pruned_at = now
+        self.conn.execute("DELETE FROM buckets WHERE updated < ?", (now - self._max_period,))
+
+    def _take(self, key, limit):
+        # Wall-clock time, since monotonic clocks are not comparable across processes.
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (limit.limit, now)
+            allowed, tokens, retry_after = take_token(refill(tokens, updated, now, limit), limit)
+            self.conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self._max_period = max(self._max_period, limit.period)
+        if now - self._pruned_at >= self.prune_interval:
+            self._prune(now)
+        return allowed, tokens, retry_after
+
+    async def take(self, key, limit):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._take, key, limit)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.conn.close()
+
+
+def create_store(name, sqlite_path="ratelimit.db"):
+    if name == "memory":
+        return MemoryStore()
+    if name == "sqlite":
+        return SQLiteStore(sqlite_path)
+    raise ValueError(f"Unknown RATE_LIMIT_STORE {name!r}, expected 'memory' or 'sqlite'")
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware that applies the route's limit to the calling client and
+    reports it in X-RateLimit-* headers. Over-limit requests get a 429 with
+    Retry-After without reaching the endpoint.
+    """
+
+    def __init__(self, app, limits, store, api_keys=(), on_limited=None, trusted_proxies=()):
+        self.app = app
+        self.limits = limits
+        self.store = store
+        self.api_keys = set(api_keys)
+        self.on_limited = on_limited
+        self.trusted_proxies = trusted_proxies
+
+    def trusts(self, host):
+        if self.trusted_proxies == "*":
+            return True
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def client_ip(self, scope):
+        client = scope.get("client")
+        host = client[0] if client else None
+        if host is None or not self.trusted_proxies or not self.trusts(host):
+            return host
+        hops = [
+            hop.strip()
+            for name, value in scope["headers"] if name == b"x-forwarded-for"
+            for hop in value.decode("latin-1").split(",") if hop.strip()
+        ]
+        if not hops:
+            return host
+        if self.trusted_proxies == "*":
+            return hops[-1]
+        # Walk back from the proxy nearest us; the first hop we do not trust is the client.
+        for hop in reversed(hops):
+            if not self.trusts(hop):
+                return hop
+        return hops[0]
+
+    def client_key(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"x-api-key":
+                api_key = value.decode("latin-1")
+                # Unknown keys fall back to the IP so rotating keys can't dodge the limit.
+                if api_key in self.api_keys:
+                    return f"key:{api_key}"
+                break
+        return f"ip:{self.client_ip(scope) or 'unknown'}"
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+
+        allowed, remaining, retry_after = await self.store.take(f"{scope['path']}|{self.client_key(scope)}", limit)
+        headers = [
+            (b"x-ratelimit-limit", str(limit.limit).encode()),
+            (b"x-ratelimit-remaining", str(int(remaining)).encode()),
+            (b"x-ratelimit-reset", str(int((limit.limit - remaining) / limit.rate + 0.999)).encode()),
+        ]
+
+        if not allowed:
+            if self.on_limited is not None:
+                self.on_limited(scope["path"])
+            body = json.dumps({"detail": "Rate limit exceeded"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"retry-after", str(int(retry_after + 0.999)).encode()),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,137 @@
+import asyncio
+import random
+import time
+from collections import deque
+
+from backends import UpstreamError
+from logging_config import logger
+
+# Upstream HTTP statuses worth another attempt: throttling and server-side failures.
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the overall budget for a call runs out.
+    """
+
+    status_code = 504
+
+
+def is_retryable(exc):
+    """
+    Retry on retryable HTTP statuses, on timeouts, and on network errors with no status.
+
+    UpstreamError carries the status as status_code; google.api_core errors as code.
+    """
+    if isinstance(exc, asyncio.TimeoutError):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(exc, "code", None)
+    if status is None:
+        # Our backends raise UpstreamError without a status only when the request never got an answer.
+        return isinstance(exc, UpstreamError)
+    return isinstance(status, int) and status in RETRYABLE_STATUSES
+
+
+class RetryPolicy:
+    """
+    Runs an upstream call with retries and optional hedging inside one time budget.
+
+    fn(timeout) is called for each attempt with the seconds left in the budget,
+    which ends at the caller's deadline if that comes first.
+    Failed attempts whose error is_retryable() are retried up to `attempts` times
+    in total, sleeping a full-jitter exponential backoff between them: a random
+    time up to min(max_delay, base_delay * 2**n). No retry is started if its
+    backoff would not fit in what remains of the budget.
+
+    With hedge enabled, an attempt that has not answered by the p95 latency of
+    recent successful attempts gets a second copy started next to it, and
+    whichever finishes first wins. Until min_samples latencies are known,
+    hedge_after seconds is used instead.
+
+    on_event(kind) is called for "retry", "hedge" and "hedge_won".
+    """
+
+    def __init__(self, attempts=3, base_delay=0.5, max_delay=8.0, budget=90.0, hedge=False,
+                 hedge_quantile=0.95, hedge_after=10.0, min_samples=20, on_event=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_after = hedge_after
+        self.min_samples = min_samples
+        self.on_event = on_event
+        self._latencies = deque(maxlen=500)
+
+    def backoff(self, retry):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    def hedge_delay(self):
+        if len(self._latencies) < self.min_samples:
+            return self.hedge_after
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))]
+
+    def _event(self, kind):
+        if self.on_event is not None:
+            self.on_event(kind)
+
+    async def run(self, fn, deadline=None):
+        """
+        deadline is an absolute time.monotonic() the whole call must finish by.
+        """
+        budget_end = time.monotonic() + self.budget
+        deadline = budget_end if deadline is None else min(deadline, budget_end)
+        for attempt in range(self.attempts):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("Model call did not finish before the deadline")
+            try:
+                if self.hedge:
+                    return await self._hedged(fn, deadline)
+                return await self._attempt(fn, remaining)
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError) and time.monotonic() >= deadline:
+                    raise DeadlineExceeded("Model call did not finish before the deadline") from e
+                if attempt + 1 >= self.attempts or not is_retryable(e):
+                    raise
+                delay = self.backoff(attempt)
+                if time.monotonic() + delay >= deadline:
+                    raise
+                logger.warning("retrying model call", extra={"attempt": attempt + 1, "delay": round(delay, 3), "error": str(e)})
+                self._event("retry")
+                await asyncio.sleep(delay)
+
+    async def _attempt(self, fn, timeout):
+        start = time.monotonic()
+        result = await fn(timeout)
+        self._latencies.append(time.monotonic() - start)
+        return result
+
+    async def _hedged(self, fn, deadline):
+        first = asyncio.ensure_future(self._attempt(fn, deadline - time.monotonic()))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=min(self.hedge_delay(), deadline - time.monotonic()))
+            if not done and time.monotonic() < deadline:
+                self._event("hedge")
+                pending.add(asyncio.ensure_future(self._attempt(fn, deadline - time.monotonic())))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self._event("hedge_won")
+                        return task.result()
+                    error = task.exception()
+            # Every copy failed; surface the last error so the caller can decide on a retry.
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,64 @@
+from typing import List, Union
+
+from pydantic import BaseModel, Field
+
+from streaming import STREAM_FIELDS
+
+
+class Disease(BaseModel):
+    name: str
+    # The Flutter client accepts numbers or strings such as "75%".
+    confidence: Union[int, float, str]
+
+
+class Prediction(BaseModel):
+    """
+    The prediction contract shared by the model output and the API response.
+    """
+
+    top_3_possible_diseases: List[Disease] = Field(min_length=1)
+    explanation: str
+    urgency: str
+    recommended_next_steps: List[str]
+    disclaimer: str
+
+
+# The same contract as a Gemini response schema, so the model is constrained
+# to emit exactly this JSON object. Gemini writes properties in alphabetical
+# order unless told otherwise, which would put disclaimer first and hold back
+# the streamed fields, so propertyOrdering lists STREAM_FIELDS first.
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "top_3_possible_diseases": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": {"type": "STRING"},
+                    "confidence": {"type": "INTEGER"},
+                },
+                "required": ["name", "confidence"],
+                "propertyOrdering": ["name", "confidence"],
+            },
+        },
+        "explanation": {"type": "STRING"},
+        "urgency": {"type": "STRING", "format": "enum", "enum": ["Low", "Moderate", "High"]},
+        "recommended_next_steps": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "disclaimer": {"type": "STRING"},
+    },
+    "required": [
+        "top_3_possible_diseases",
+        "explanation",
+        "urgency",
+        "recommended_next_steps",
+        "disclaimer",
+    ],
+    "propertyOrdering": [*STREAM_FIELDS, "disclaimer"],
+}
+
+# A micro-batch of several cases answered in one call: one prediction per image, in order.
+BATCH_RESPONSE_SCHEMA = {
+    "type": "ARRAY",
+    "items": RESPONSE_SCHEMA,
+}
@@ -1,29 +1,318 @@
 import os
-import base64
-import random
-import json
-from fastapi import FastAPI, HTTPException
+import asyncio
+import functools
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
 
-# Optional Gemini AI
-try:
-    import google.generativeai as genai
+import json_codec
+import metrics
+from admission import AdmissionController, Overloaded
+from backends import create_backend
+from batching import MicroBatcher
+from circuit_breaker import STATE_VALUES, CircuitBreaker, CircuitOpenError
+from deadlines import DeadlineMiddleware, deadline_var, remaining
+from image_pipeline import InvalidImageError, fingerprint_image, normalize_image
+from jobs import JobQueue, QueueFullError
+from json_upload import InvalidBodyError, JsonImageParser, PayloadTooLarge
+from logging_config import RequestIdMiddleware, dropped_records, logger, sample_raw, setup_logging, shutdown_logging
+from near_duplicate import NearDuplicateIndex
+from prediction_cache import PredictionCache, image_digest, make_cache_key, symptoms_key
+from prediction_store import PredictionStore
+from prompts import PromptRegistry, parse_rollout
+from rate_limit import RateLimitMiddleware, create_store, parse_limits, parse_trusted_proxies
+from retry import DeadlineExceeded, RetryPolicy, is_retryable
+from schemas import Prediction
+from single_flight import SingleFlight
+from streaming import STREAM_FIELDS, FieldExtractor, sse_event
 
-    USE_GEMINI = True
-except ImportError:
-    USE_GEMINI = False
+# Inference backend (gemini, dummy or fake), chosen by INFERENCE_BACKEND.
+# Expensive setup such as importing the Gemini SDK waits for the startup hook.
+backend = create_backend()
+# BACKEND_WARMUP=1 makes a cheap upstream call at startup, before /readyz reports ready,
+# and caches the instruction block of every prompt version in the rollout upstream.
+BACKEND_WARMUP = os.getenv("BACKEND_WARMUP", "0") == "1"
+BACKEND_WARMUP_TIMEOUT = float(os.getenv("BACKEND_WARMUP_TIMEOUT", "30"))
+backend_status = {"ready": False, "error": None}
+
+# Admission control for model calls: how many run at once, how many may wait
+# for a slot and for how long, and the Retry-After sent when a request is turned away.
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_PREDICTIONS", "8")),
+    max_queue=int(os.getenv("ADMISSION_QUEUE_SIZE", "32")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10")),
+)
+ADMISSION_RETRY_AFTER = os.getenv("ADMISSION_RETRY_AFTER", "5")
+metrics.ADMISSION_WAITING.set_function(lambda: admission.waiting)
+metrics.ADMISSION_ACTIVE.set_function(lambda: admission.active)
+
+# Circuit breaker around model calls: the failure or slow-call rate over the last
+# CIRCUIT_WINDOW calls that opens it, and how long it stays open before probing.
+breaker = CircuitBreaker(
+    window=int(os.getenv("CIRCUIT_WINDOW", "20")),
+    min_calls=int(os.getenv("CIRCUIT_MIN_CALLS", "10")),
+    failure_rate=float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5")),
+    slow_call_seconds=float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "30")),
+    slow_call_rate=float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.5")),
+    open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+    # Timeouts, throttling and server errors; a 4xx for one bad image or prompt says nothing about upstream health.
+    is_failure=is_retryable,
+    on_state_change=lambda state: metrics.CIRCUIT_TRANSITIONS.labels(state).inc(),
+)
+
+# Retries of retryable model errors with jittered exponential backoff, all inside
+# MODEL_DEADLINE seconds. MODEL_HEDGE=1 also starts a second copy of a call that
+# has not answered by the p95 latency, at the cost of extra upstream calls.
+retry_policy = RetryPolicy(
+    attempts=int(os.getenv("MODEL_RETRY_ATTEMPTS", "3")),
+    base_delay=float(os.getenv("MODEL_RETRY_BASE_DELAY", "0.5")),
+    max_delay=float(os.getenv("MODEL_RETRY_MAX_DELAY", "8")),
+    budget=float(os.getenv("MODEL_DEADLINE", "90")),
+    hedge=os.getenv("MODEL_HEDGE", "0") == "1",
+    hedge_after=float(os.getenv("MODEL_HEDGE_AFTER", "10")),
+    on_event=lambda kind: metrics.MODEL_RETRY_EVENTS[kind].inc(),
+)
+
+# Micro-batching: model calls that start within MODEL_BATCH_WINDOW_MS of each
+# other, up to MODEL_BATCH_MAX_SIZE, go upstream as one multi-image request and
+# take one admission slot and one quota unit between them. Off while
+# MODEL_BATCH_MAX_SIZE is 1. Streaming requests are never batched.
+MODEL_BATCH_MAX_SIZE = int(os.getenv("MODEL_BATCH_MAX_SIZE", "1"))
+MODEL_BATCH_WINDOW = float(os.getenv("MODEL_BATCH_WINDOW_MS", "20")) / 1000
+# One batcher per prompt version, since a batch shares one prompt.
+batchers = {}
+metrics.CIRCUIT_STATE.set_function(lambda: STATE_VALUES[breaker.state])
+metrics.BACKEND_READY.set_function(lambda: backend_status["ready"])
+
+# Asynchronous job API: worker count, queue bound and how long finished results are kept.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))
+# Webhooks make the server call arbitrary URLs, so they are off unless enabled.
+JOB_WEBHOOKS_ENABLED = os.getenv("JOB_WEBHOOKS_ENABLED", "0") == "1"
+
+# Seconds a request may take when the client sends no X-Request-Timeout, and the
+# most a client may ask for. The remainder bounds the model call.
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "85"))
+REQUEST_MAX_TIMEOUT = float(os.getenv("REQUEST_MAX_TIMEOUT", "120"))
+
+# Per-client rate limits as ROUTE=LIMIT/SECONDS, e.g.
+# "/predict_json=30/60,/predict=30/60,/predict_stream=30/60,/jobs=30/60".
+# Off by default: behind a load balancer every request arrives from the
+# balancer's address, so until clients can be told apart they would all share
+# one bucket. RATE_LIMIT_STORE=sqlite shares buckets between worker processes
+# through RATE_LIMIT_SQLITE_PATH. Clients sending one of RATE_LIMIT_API_KEYS in
+# X-API-Key are limited per key, everyone else per IP.
+# Behind a load balancer, tell clients apart in one of two ways, not both:
+# run uvicorn with --forwarded-allow-ips=<balancer> (its --proxy-headers is on
+# by default but only trusts 127.0.0.1), which rewrites the client address
+# before it reaches us, or leave uvicorn's default and
+# set RATE_LIMIT_TRUSTED_PROXIES to the balancer's addresses or CIDR networks,
+# or to "*" when they are not known (as on Render and similar hosts, where only
+# the balancer can reach the server), so the limiter reads X-Forwarded-For.
+RATE_LIMITS = parse_limits(os.getenv("RATE_LIMITS", ""))
+rate_limit_store = create_store(
+    os.getenv("RATE_LIMIT_STORE", "memory"),
+    sqlite_path=os.getenv("RATE_LIMIT_SQLITE_PATH", "ratelimit.db"),
+)
+RATE_LIMIT_API_KEYS = [key for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key]
+RATE_LIMIT_TRUSTED_PROXIES = parse_trusted_proxies(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", ""))
+
+
+# Largest image accepted by the binary /predict endpoint.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Room for part headers, boundaries and the symptoms field in a multipart /predict body.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Largest JSON body accepted: a base64-encoded MAX_UPLOAD_BYTES image plus room for the other fields.
+MAX_JSON_BODY_BYTES = int(os.getenv("MAX_JSON_BODY_BYTES", str(MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024)))
+
+# Images are re-encoded to a metadata-free JPEG no larger than this before inference.
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# Images declaring more pixels than this are refused with 422 before they are decoded,
+# since a small file can still decode to hundreds of megabytes.
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "50000000"))
+
+# Prompt templates by version, compiled from PROMPT_DIR at startup. PROMPT_VERSION
+# picks the version to serve, or splits traffic between several as
+# VERSION=WEIGHT,... ("v1=90,v2=10"), with each image sticking to one version.
+# The version is part of every cache key and is returned as prompt_version, so
+# a new version never reuses answers from the old one. At most
+# PROMPT_MAX_SYMPTOM_CHARS of the symptom text reach the prompt. A version's
+# static instruction block is cached upstream by backends that support it
+# (GEMINI_CACHE_TTL seconds, 0 to send it inline with every call); v2 has one,
+# and can be tried on part of the traffic with e.g. PROMPT_VERSION="v1=90,v2=10".
+prompts = PromptRegistry.load(
+    os.getenv("PROMPT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_templates")),
+    parse_rollout(os.getenv("PROMPT_VERSION", "v1")),
+    max_symptom_chars=int(os.getenv("PROMPT_MAX_SYMPTOM_CHARS", "2000")),
+)
+
+# Content-addressed cache of parsed predictions, keyed by image digest, symptoms and prompt version.
+prediction_cache = PredictionCache(
+    max_entries=int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "1024")),
+    max_bytes=int(os.getenv("PREDICTION_CACHE_MAX_BYTES", str(16 * 1024 * 1024))),
+    ttl=float(os.getenv("PREDICTION_CACHE_TTL", "3600")),
+)
+
+# Durable copy of the cache in SQLite, shared by every worker on the host. It
+# answers memory-cache misses and warms the memory cache at startup, so a
+# restarted instance does not pay the model again for images it has seen.
+# PREDICTION_STORE_PATH="" turns it off. A relative path is resolved against
+# the working directory. The store is opened at startup; if SQLite cannot open
+# it, the server logs the error and runs on the memory cache alone.
+PREDICTION_STORE_PATH = os.getenv("PREDICTION_STORE_PATH", "predictions.db")
+PREDICTION_STORE_TTL = float(os.getenv("PREDICTION_STORE_TTL", str(7 * 24 * 3600)))
+PREDICTION_STORE_MAX_ENTRIES = int(os.getenv("PREDICTION_STORE_MAX_ENTRIES", "100000"))
+PREDICTION_STORE_COMPACT_INTERVAL = float(os.getenv("PREDICTION_STORE_COMPACT_INTERVAL", "3600"))
+prediction_store = None
+
+# Model calls currently in flight, keyed the same way as the cache.
+inflight_predictions = SingleFlight()
+
+# NEAR_DUPLICATE_CACHE=1 lets photos whose 64-bit perceptual hashes differ in at
+# most NEAR_DUPLICATE_MAX_DISTANCE bits, and whose 256-bit check hashes differ
+# in at most NEAR_DUPLICATE_CHECK_DISTANCE, share a cached answer when sent
+# with the same symptoms: the client re-encodes every pick, so a re-shot photo
+# never matches exactly. Off by default, since a false match serves one
+# patient another's diagnosis; low-contrast photos never match.
+near_duplicates = None
+if os.getenv("NEAR_DUPLICATE_CACHE", "0") == "1":
+    near_duplicates = NearDuplicateIndex(
+        max_distance=int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "2")),
+        max_entries=int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "100000")),
+        check_distance=int(os.getenv("NEAR_DUPLICATE_CHECK_DISTANCE", "8")),
+    )
+
+
+setup_logging()
+
+
+async def initialize_backend():
+    """
+    Start the backend and optionally warm it up, then mark the server ready.
+
+    Runs in the background so the server accepts connections, and answers
+    liveness checks, while the SDK loads. A failed warm-up is only logged;
+    a backend that cannot start at all keeps /readyz failing.
+    """
+    start = time.perf_counter()
+    try:
+        await backend.start()
+    except Exception as e:
+        backend_status["error"] = str(e)
+        logger.error("backend failed to start", extra={"backend": backend.name, "error": str(e)})
+        return
+    if BACKEND_WARMUP:
+        try:
+            await asyncio.wait_for(backend.warm_up(), BACKEND_WARMUP_TIMEOUT)
+        except Exception as e:
+            logger.warning("backend warm-up failed", extra={"backend": backend.name, "error": str(e)})
+        instructions = {prompt.system for prompt, _ in prompts.rollout if prompt.system}
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(backend.cache_instruction(instruction) for instruction in instructions)),
+                BACKEND_WARMUP_TIMEOUT,
+            )
+        except Exception as e:
+            logger.warning("instruction caching at startup failed", extra={"backend": backend.name, "error": str(e)})
+    backend_status["ready"] = True
+    logger.info(
+        "backend ready",
+        extra={"backend": backend.name, "warm_up": BACKEND_WARMUP, "startup_seconds": round(time.perf_counter() - start, 3)},
+    )
+
+
+def open_prediction_store():
+    """
+    Open the SQLite prediction store, or return None if it is turned off or cannot be opened.
+    """
+    if not PREDICTION_STORE_PATH:
+        return None
+    try:
+        return PredictionStore(PREDICTION_STORE_PATH, ttl=PREDICTION_STORE_TTL, max_entries=PREDICTION_STORE_MAX_ENTRIES)
+    except sqlite3.Error as e:
+        logger.error("prediction store unavailable, running without it", extra={"path": PREDICTION_STORE_PATH, "error": str(e)})
+        return None
+
+
+async def warm_prediction_cache():
+    """
+    Load the newest stored predictions into the memory cache, oldest first so the newest are least likely evicted.
+    """
+    try:
+        entries = await prediction_store.recent(prediction_cache.max_entries)
+    except sqlite3.Error as e:
+        logger.warning("prediction store warm-up failed", extra={"error": str(e)})
+        return
+    for key, prediction, age in reversed(entries):
+        prediction_cache.set(key, prediction, ttl=prediction_store.ttl - age)
+    logger.info("prediction cache warmed", extra={"entries": len(entries)})
+
+
+async def compact_prediction_store():
+    while True:
+        await asyncio.sleep(PREDICTION_STORE_COMPACT_INTERVAL)
+        start = time.perf_counter()
+        try:
+            removed = await prediction_store.compact()
+        except sqlite3.Error as e:
+            logger.warning("prediction store compaction failed", extra={"error": str(e)})
+            continue
+        logger.info(
+            "prediction store compacted",
+            extra={"removed": removed, "file_bytes": prediction_store.file_bytes(), "seconds": round(time.perf_counter() - start, 3)},
+        )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global prediction_store
+    job_queue.start()
+    backend_init = asyncio.create_task(initialize_backend())
+    prediction_store = open_prediction_store()
+    store_compaction = None
+    if prediction_store is not None:
+        await warm_prediction_cache()
+        store_compaction = asyncio.create_task(compact_prediction_store())
+    yield
+    backend_init.cancel()
+    if store_compaction is not None:
+        store_compaction.cancel()
+    await job_queue.stop()
+    await backend.close()
+    rate_limit_store.close()
+    if prediction_store is not None:
+        prediction_store.close()
+    shutdown_logging()
 
-# Configure Gemini
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if USE_GEMINI:
-    if not GEMINI_API_KEY:
-        raise ValueError("GEMINI_API_KEY not set in environment variables.")
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel("gemini-2.5-flash")
 
 # Initialize FastAPI
-app = FastAPI(title="AfiyahMed AI Skin Diagnosis")
+app = FastAPI(title="AfiyahMed AI Skin Diagnosis", lifespan=lifespan, default_response_class=json_codec.ResponseClass)
+
+app.add_middleware(
+    DeadlineMiddleware,
+    default_timeout=REQUEST_TIMEOUT,
+    max_timeout=REQUEST_MAX_TIMEOUT,
+    on_cancel=lambda reason: metrics.CANCELLED[reason].inc(),
+)
+
+# Rate limiting and deadlines sit inside CORS so browsers can read their 429 and 504 responses.
+app.add_middleware(
+    RateLimitMiddleware,
+    limits=RATE_LIMITS,
+    store=rate_limit_store,
+    api_keys=RATE_LIMIT_API_KEYS,
+    on_limited=lambda route: metrics.RATE_LIMITED.labels(route).inc(),
+    trusted_proxies=RATE_LIMIT_TRUSTED_PROXIES,
+)
 
 # CORS setup
 app.add_middleware(
@@ -33,25 +322,48 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(RequestIdMiddleware)
 
 
 # Request model
-class PredictRequest(BaseModel):
+class PredictFields(BaseModel):
     symptoms: str
+
+
+class PredictRequest(PredictFields):
+    image_base64: str
+
+
+class JobFields(PredictFields):
+    callback_url: Optional[str] = None
+
+
+class JobRequest(JobFields):
     image_base64: str
 
 
-def parse_gemini_response(response_text):
+def parse_gemini_response(response_text, log_raw=False):
     """
-    Parse the JSON response from Gemini AI.
-    Handles cases where Gemini wraps JSON in markdown code blocks or adds extra text.
+    Parse and validate the JSON response from the model.
+
+    Structured output should already be exactly the Prediction object, so it is
+    parsed and validated in one pass by the compiled Pydantic model. Anything
+    else falls back to scraping: Gemini may wrap the JSON in markdown code blocks
+    or add extra text around it.
     """
+    try:
+        prediction = Prediction.model_validate_json(response_text)
+        metrics.PARSE_PATHS["schema"].inc()
+        return prediction.model_dump()
+    except ValidationError:
+        pass
+
     try:
         # First, try to remove markdown code blocks
-        if "\`\`\`json" in response_text:
-            response_text = response_text.split("\`\`\`json")[1].split("\`\`\`")[0].strip()
-        elif "\`\`\`" in response_text:
-            response_text = response_text.split("\`\`\`")[1].split("\`\`\`")[0].strip()
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
 
         # Look for the first { and last } to extract the JSON object
         start_idx = response_text.find('{')
@@ -62,128 +374,714 @@ def parse_gemini_response(response_text):
 
         response_text = response_text.strip()
 
-        print(f"[v0] Cleaned response: {response_text[:300]}...")
+        if log_raw:
+            logger.info("cleaned model response", extra={"cleaned": response_text[:300]})
 
-        # Parse the JSON string
-        parsed = json.loads(response_text)
+        # Parse the JSON string and validate it against the prediction contract
+        prediction = Prediction.model_validate(json_codec.loads(response_text))
+        metrics.PARSE_PATHS["scraped"].inc()
+        return prediction.model_dump()
 
-        required_fields = ["top_3_possible_diseases", "explanation", "urgency", "recommended_next_steps", "disclaimer"]
-        for field in required_fields:
-            if field not in parsed:
-                print(f"[v0] Missing field: {field}")
-                raise ValueError(f"Missing required field: {field}")
+    except json_codec.JSONDecodeError as e:
+        metrics.PARSE_PATHS["failed"].inc()
+        logger.warning("model response is not valid JSON", extra={"error": str(e), "raw": response_text[:500]})
+        return None
+    except ValidationError as e:
+        metrics.PARSE_PATHS["failed"].inc()
+        logger.warning("model response failed validation", extra={"error": str(e)[:300], "raw": response_text[:500]})
+        return None
 
-        if not isinstance(parsed["top_3_possible_diseases"], list) or len(parsed["top_3_possible_diseases"]) == 0:
-            raise ValueError("Invalid diseases structure")
 
-        for disease in parsed["top_3_possible_diseases"]:
-            if "name" not in disease or "confidence" not in disease:
-                raise ValueError("Disease missing name or confidence")
+# Returned when the model answered but its output could not be used.
+FALLBACK_PREDICTION = {
+    "top_3_possible_diseases": [
+        {"name": "Analysis Error", "confidence": 0}
+    ],
+    "explanation": "Unable to analyze the image. Please try again with a clearer image.",
+    "urgency": "Low",
+    "recommended_next_steps": [
+        "Ensure the image is clear and well-lit",
+        "Try uploading a different image",
+        "Consult a dermatologist directly"
+    ],
+    "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
+}
+
+# Returned without calling the model while the circuit breaker is open.
+DEGRADED_PREDICTION = {
+    "top_3_possible_diseases": [
+        {"name": "Service Unavailable", "confidence": 0}
+    ],
+    "explanation": "The image analysis service is temporarily unavailable. Please try again in a few minutes.",
+    "urgency": "Low",
+    "recommended_next_steps": [
+        "Try again in a few minutes",
+        "Consult a dermatologist directly if symptoms are severe or worsening"
+    ],
+    "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
+}
 
-        print("[v0] Successfully parsed Gemini response")
-        return parsed
 
-    except json.JSONDecodeError as e:
-        print(f"[v0] JSON parsing error: {str(e)}")
-        print(f"[v0] Raw response: {response_text[:500]}")
+def split_batch_response(response_text, count):
+    """
+    Split a batched model answer into one JSON text per case, or return None if it is not an array of count objects.
+    """
+    start_idx = response_text.find("[")
+    end_idx = response_text.rfind("]")
+    try:
+        answers = json_codec.loads(response_text[start_idx:end_idx + 1])
+    except json_codec.JSONDecodeError:
         return None
-    except ValueError as e:
-        print(f"[v0] Validation error: {str(e)}")
+    if not isinstance(answers, list) or len(answers) != count or not all(isinstance(a, dict) for a in answers):
         return None
+    return [json_codec.dumps(answer).decode("utf-8") for answer in answers]
 
 
-# Predict endpoint
-@app.post("/predict_json")
-async def predict_json(request: PredictRequest):
+async def preprocess_image(image_bytes):
+    """
+    Normalize an uploaded image off the event loop and log how much it shrank.
+    """
+    loop = asyncio.get_running_loop()
+    with metrics.STAGES["normalize"].time():
+        normalized, info = await loop.run_in_executor(
+            None, normalize_image, image_bytes, IMAGE_MAX_EDGE, IMAGE_JPEG_QUALITY, IMAGE_MAX_PIXELS
+        )
+    logger.info("image normalized", extra=info)
+    return normalized
+
+
+async def generate_once(prompt, image_bytes, symptoms, timeout, instruction=None):
+    """
+    One model attempt, counted by the circuit breaker and cut off after timeout seconds.
+    """
+    async with breaker.call():
+        return await asyncio.wait_for(
+            backend.generate(prompt, image_bytes, symptoms, instruction=instruction, timeout=timeout), timeout
+        )
+
+
+def record_usage(usage):
+    """
+    Count the tokens a model call reported, including those served from the upstream instruction cache.
+    """
+    for key, value in usage.items():
+        metrics.MODEL_TOKENS[key].inc(value)
+    logger.info("model usage", extra=usage)
+
+
+backend.on_usage = record_usage
+
+
+async def fingerprint(image_bytes):
+    loop = asyncio.get_running_loop()
+    with metrics.STAGES["fingerprint"].time():
+        return await loop.run_in_executor(
+            None, functools.partial(fingerprint_image, image_bytes, max_pixels=IMAGE_MAX_PIXELS)
+        )
+
+
+async def lookup_prediction(cache_key):
+    """
+    Return the cached prediction for a key from memory, or from the store on a memory miss.
+    """
+    prediction = prediction_cache.get(cache_key)
+    if prediction is not None or prediction_store is None:
+        return prediction
     try:
-        # Decode the base64 image
-        image_bytes = base64.b64decode(request.image_base64)
+        stored = await prediction_store.get(cache_key)
+    except sqlite3.Error as e:
+        logger.warning("prediction store read failed", extra={"error": str(e)})
+        return None
+    if stored is None:
+        return None
+    prediction, age = stored
+    # Kept in memory no longer than the stored row has left to live.
+    prediction_cache.set(cache_key, prediction, ttl=prediction_store.ttl - age)
+    return prediction
 
-        prompt = f"""You are a dermatologist AI. Analyze this patient's skin image and symptoms carefully.
 
-Patient Symptoms: {request.symptoms}
+async def find_near_duplicate(image_hashes, symptoms, prompt_version):
+    """
+    Return the cached prediction for a near-identical photo with the same symptoms and prompt version, if any.
+    """
+    match = near_duplicates.lookup(*image_hashes, symptoms_key(symptoms, prompt_version))
+    if match is None:
+        return None
+    key, distance = match
+    prediction = await lookup_prediction(key)
+    if prediction is None:
+        # The cached answer has expired or been evicted since it was indexed.
+        near_duplicates.discard(key)
+        return None
+    logger.info("near-duplicate cache hit", extra={"distance": distance})
+    return prediction
+
+
+async def remember_prediction(cache_key, prediction, symptoms, prompt_version, image_hashes):
+    prediction_cache.set(cache_key, prediction)
+    if image_hashes is not None:
+        near_duplicates.add(*image_hashes, symptoms_key(symptoms, prompt_version), cache_key)
+    if prediction_store is not None:
+        # The prediction is already served from memory; a failed write only costs durability.
+        try:
+            await prediction_store.put(cache_key, prediction)
+        except sqlite3.Error as e:
+            logger.warning("prediction store write failed", extra={"error": str(e)})
+
+
+async def call_model(prompt, image_bytes, symptoms, deadline, instruction=None):
+    """
+    Run one model call, with retries, once an admission slot is free.
+    """
+    async with admission.slot():
+        with metrics.STAGES["model"].time():
+            return await retry_policy.run(
+                lambda timeout: generate_once(prompt, image_bytes, symptoms, timeout, instruction),
+                deadline=deadline,
+            )
+
+
+async def generate_batch_once(prompt, images, symptoms_list, timeout):
+    async with breaker.call():
+        return await asyncio.wait_for(backend.generate_batch(prompt, images, symptoms_list, timeout=timeout), timeout)
+
+
+def batcher_for(prompt):
+    batcher = batchers.get(prompt.version)
+    if batcher is None:
+        batcher = batchers[prompt.version] = MicroBatcher(
+            lambda items: run_model_batch(prompt, items),
+            window=MODEL_BATCH_WINDOW,
+            max_size=MODEL_BATCH_MAX_SIZE,
+            on_batch=metrics.observe_batch,
+        )
+    return batcher
 
-Return ONLY a valid JSON object with this exact structure (no markdown, no extra text):
-{{
-    "top_3_possible_diseases": [
-        {{"name": "Disease Name", "confidence": 75}},
-        {{"name": "Disease Name", "confidence": 20}},
-        {{"name": "Disease Name", "confidence": 5}}
-    ],
-    "explanation": "Brief explanation considering both the image and symptoms",
-    "urgency": "Low/Moderate/High",
-    "recommended_next_steps": [
-        "Step 1",
-        "Step 2",
-        "Step 3"
-    ],
-    "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
-}}"""
-
-        # Use Gemini AI if enabled
-        if USE_GEMINI:
-            try:
-                response = model.generate_content([
-                    prompt,
-                    {"mime_type": "image/jpeg", "data": image_bytes}
-                ])
-
-                print(f"[v0] Gemini raw response: {response.text[:500]}...")
-                parsed_response = parse_gemini_response(response.text)
-
-                if parsed_response is None:
-                    print("[v0] Parsing failed, returning error response")
-                    return {
-                        "prediction": {
-                            "top_3_possible_diseases": [
-                                {"name": "Analysis Error", "confidence": 0}
-                            ],
-                            "explanation": "Unable to analyze the image. Please try again with a clearer image.",
-                            "urgency": "Low",
-                            "recommended_next_steps": [
-                                "Ensure the image is clear and well-lit",
-                                "Try uploading a different image",
-                                "Consult a dermatologist directly"
-                            ],
-                            "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
-                        }
-                    }
-
-                return {
-                    "prediction": parsed_response
-                }
-            except Exception as gemini_error:
-                print(f"[v0] Gemini API error: {str(gemini_error)}")
-                raise HTTPException(status_code=500, detail=f"Gemini API error: {str(gemini_error)}")
-
-        # Dummy structured output for testing (always returns structured JSON)
-        disease_names = ["Eczema", "Psoriasis", "Dermatitis", "Rosacea", "Fungal Infection"]
-        random.shuffle(disease_names)
-        percentages = [random.randint(20, 50) for _ in range(3)]
-        total = sum(percentages)
-        percentages = [round(p * 100 / total) for p in percentages]
-        diff = 100 - sum(percentages)
-        if diff != 0:
-            percentages[0] += diff
-
-        top_diseases = [
-            {"name": disease_names[i], "confidence": percentages[i]}
-            for i in range(3)
-        ]
 
+async def run_model_batch(prompt, items):
+    """
+    Answer a micro-batch of (prompt_text, image_bytes, symptoms, deadline) items
+    for one prompt version with one model call and return one response text per item.
+
+    The batch runs until the latest deadline among its items; callers with an
+    earlier one are cut off by their own request deadline. If the version has no
+    batch template, or the answer does not split into one prediction per item,
+    each item is run on its own, with the version's instruction block.
+    """
+    symptoms_list = [symptoms for _, _, symptoms, _ in items]
+    deadlines = [deadline for _, _, _, deadline in items]
+    with metrics.STAGES["prompt"].time():
+        batch_prompt = prompt.build_batch(symptoms_list) if len(items) > 1 else None
+    if batch_prompt is None:
+        return await asyncio.gather(
+            *(call_model(*item, instruction=prompt.system) for item in items), return_exceptions=True
+        )
+
+    async with admission.slot():
+        start = time.perf_counter()
+        response_text = await retry_policy.run(
+            lambda timeout: generate_batch_once(batch_prompt, [image for _, image, _, _ in items], symptoms_list, timeout),
+            deadline=None if None in deadlines else max(deadlines),
+        )
+        elapsed = time.perf_counter() - start
+    for _ in items:
+        metrics.STAGES["model"].observe(elapsed)
+
+    answers = split_batch_response(response_text, len(items))
+    if answers is None:
+        logger.warning(
+            "batched model response did not split into one answer per case, retrying one by one",
+            extra={
+                "backend": backend.name, "prompt_version": prompt.version, "batch_size": len(items), "raw": response_text[:500],
+            },
+        )
+        return await asyncio.gather(
+            *(call_model(*item, instruction=prompt.system) for item in items), return_exceptions=True
+        )
+    return answers
+
+
+async def run_model_prediction(prompt, image_bytes, symptoms, cache_key, image_hashes=None):
+    """
+    Call the backend with a prompt version's prompt and the image, parse the result and cache it on success.
+    """
+    breaker.check()
+    with metrics.STAGES["prompt"].time():
+        prompt_text = prompt.build(symptoms)
+    image_bytes = await preprocess_image(image_bytes)
+    if MODEL_BATCH_MAX_SIZE > 1:
+        response_text = await batcher_for(prompt).submit((prompt_text, image_bytes, symptoms, deadline_var.get()))
+    else:
+        response_text = await call_model(
+            prompt_text, image_bytes, symptoms, deadline_var.get(), instruction=prompt.system
+        )
+
+    log_raw = sample_raw()
+    if log_raw:
+        logger.info(
+            "raw model response",
+            extra={"backend": backend.name, "prompt_version": prompt.version, "raw": response_text[:500]},
+        )
+    with metrics.STAGES["parse"].time():
+        parsed_response = parse_gemini_response(response_text, log_raw)
+
+    if parsed_response is not None:
+        await remember_prediction(cache_key, parsed_response, symptoms, prompt.version, image_hashes)
+    return parsed_response
+
+
+def overloaded_error(overloaded):
+    metrics.OUTCOMES["rejected"].inc()
+    metrics.ADMISSION_REJECTED[overloaded.reason].inc()
+    return HTTPException(status_code=503, detail=str(overloaded), headers={"Retry-After": ADMISSION_RETRY_AFTER})
+
+
+def degraded_response(circuit_open):
+    metrics.OUTCOMES["degraded"].inc()
+    logger.info("circuit open, returning degraded response", extra={"retry_after": circuit_open.retry_after})
+    return {
+        "prediction": DEGRADED_PREDICTION,
+        "degraded": True,
+    }
+
+
+async def run_prediction(image_bytes, symptoms):
+    """
+    Run the prediction path for decoded image bytes and return the response body.
+    Shared by the JSON/base64 endpoint and the binary upload endpoint.
+    """
+    digest = image_digest(image_bytes)
+    prompt = prompts.select(digest)
+    cache_key = make_cache_key(digest, symptoms, prompt.version)
+    cached = await lookup_prediction(cache_key)
+    if cached is not None:
+        metrics.OUTCOMES["cached"].inc()
         return {
-            "prediction": {
-                "top_3_possible_diseases": top_diseases,
-                "explanation": f"Based on the uploaded image and your reported symptoms ({request.symptoms}), these are the most likely skin conditions.",
-                "urgency": "Moderate",
-                "recommended_next_steps": [
-                    "Keep the affected area clean and dry.",
-                    "Avoid harsh soaps or chemicals.",
-                    "Consult a certified dermatologist for a detailed examination."
-                ],
-                "disclaimer": "This is an AI-based suggestion, not a medical diagnosis."
+            "prediction": cached,
+            "prompt_version": prompt.version,
+        }
+
+    image_hashes = None
+    if near_duplicates is not None:
+        try:
+            image_hashes = await fingerprint(image_bytes)
+        except InvalidImageError as image_error:
+            metrics.OUTCOMES["invalid_image"].inc()
+            raise HTTPException(status_code=422, detail=str(image_error))
+        near = await find_near_duplicate(image_hashes, symptoms, prompt.version)
+        if near is not None:
+            metrics.OUTCOMES["near_duplicate"].inc()
+            return {
+                "prediction": near,
+                "prompt_version": prompt.version,
             }
+
+    try:
+        # Identical requests already waiting on the model share that call instead of starting another.
+        parsed_response = await inflight_predictions.do(
+            cache_key, lambda: run_model_prediction(prompt, image_bytes, symptoms, cache_key, image_hashes)
+        )
+
+        if parsed_response is None:
+            logger.warning("parsing failed, returning fallback response")
+            metrics.OUTCOMES["parse_failed"].inc()
+            metrics.PROMPT_RESULTS.labels(prompt.version, "parse_failed").inc()
+            return {
+                "prediction": FALLBACK_PREDICTION,
+                "prompt_version": prompt.version,
+            }
+
+        metrics.OUTCOMES["parsed"].inc()
+        metrics.PROMPT_RESULTS.labels(prompt.version, "parsed").inc()
+        return {
+            "prediction": parsed_response,
+            "prompt_version": prompt.version,
         }
+    except InvalidImageError as image_error:
+        metrics.OUTCOMES["invalid_image"].inc()
+        raise HTTPException(status_code=422, detail=str(image_error))
+    except Overloaded as overloaded:
+        raise overloaded_error(overloaded)
+    except CircuitOpenError as circuit_open:
+        return degraded_response(circuit_open)
+    except DeadlineExceeded as deadline_error:
+        logger.error("model call timed out", extra={"backend": backend.name, "error": str(deadline_error)})
+        metrics.OUTCOMES["upstream_error"].inc()
+        raise HTTPException(status_code=504, detail=str(deadline_error))
+    except Exception as gemini_error:
+        logger.error("model call failed", extra={"backend": backend.name, "error": str(gemini_error)})
+        metrics.OUTCOMES["upstream_error"].inc()
+        raise HTTPException(status_code=500, detail=f"Gemini API error: {str(gemini_error)}")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+async def read_limited(chunks, limit):
+    """
+    Collect an async stream of byte chunks, raising 413 as soon as it exceeds limit.
+    """
+    buffer = bytearray()
+    async for chunk in chunks:
+        if len(buffer) + len(chunk) > limit:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {limit} bytes")
+        buffer += chunk
+    return bytes(buffer)
+
+
+def limit_body(request, limit):
+    """
+    Return request with its body capped at limit bytes, raising 413 as soon as more arrives.
+
+    Counts on the receive channel, so it holds for chunked bodies and for
+    parsers such as request.form() that read the whole body before we see it.
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > limit:
+                raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+        return message
+
+    return Request(request.scope, receive)
+
+
+def render_json(body):
+    """
+    Serialize a response body ourselves so the time shows up in the serialize stage.
+    """
+    with metrics.STAGES["serialize"].time():
+        return json_codec.ResponseClass(content=body)
+
+
+def json_upload_schema(model):
+    """
+    OpenAPI request body for endpoints that read their JSON themselves with read_json_upload.
+    """
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
+
+
+async def read_json_upload(request, fields_model):
+    """
+    Read a JSON body carrying image_base64, decoding the image as the body streams in.
+
+    Returns the image bytes and the remaining fields validated by fields_model.
+    The body is capped at MAX_JSON_BODY_BYTES and the image at MAX_UPLOAD_BYTES,
+    and either limit is answered with 413 as soon as it is crossed.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_JSON_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=f"Request body exceeds {MAX_JSON_BODY_BYTES} bytes")
+
+    parser = JsonImageParser(max_image_bytes=MAX_UPLOAD_BYTES)
+    received = 0
+    decode_seconds = 0.0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > MAX_JSON_BODY_BYTES:
+                raise HTTPException(status_code=413, detail=f"Request body exceeds {MAX_JSON_BODY_BYTES} bytes")
+            start = time.perf_counter()
+            parser.feed(chunk)
+            decode_seconds += time.perf_counter() - start
+        image_bytes, fields = parser.finish()
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidBodyError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    metrics.STAGES["decode"].observe(decode_seconds)
+
+    if image_bytes is None:
+        raise HTTPException(status_code=422, detail="Missing image_base64")
+    try:
+        return image_bytes, fields_model.model_validate(fields)
+    except ValidationError as e:
+        # Same error shape FastAPI gives for a body it validated itself.
+        errors = [{**error, "loc": ["body", *error["loc"]]} for error in e.errors(include_url=False, include_context=False)]
+        raise HTTPException(status_code=422, detail=errors)
+
+
+async def iter_upload(upload):
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+# Predict endpoint
+@app.post("/predict_json", openapi_extra=json_upload_schema(PredictRequest))
+async def predict_json(request: Request):
+    with metrics.IN_FLIGHT.track_inprogress():
+        image_bytes, fields = await read_json_upload(request, PredictFields)
+        try:
+            body = await run_prediction(image_bytes, fields.symptoms)
+        except HTTPException:
+            raise
+        except Exception as e:
+            metrics.OUTCOMES["error"].inc()
+            raise HTTPException(status_code=500, detail=str(e))
+        return render_json(body)
+
+
+async def stream_prediction(prompt, image_bytes, symptoms, cache_key, image_hashes=None):
+    """
+    Stream a prediction as server-sent events.
+
+    One event per field (top_3_possible_diseases, explanation, urgency,
+    recommended_next_steps) as soon as the model has finished generating it,
+    then a "done" event carrying the same body /predict_json would return, or
+    an "error" event if the model call fails or the request deadline passes.
+    """
+    with metrics.STAGES["prompt"].time():
+        prompt_text = prompt.build(symptoms)
+    start = time.perf_counter()
+    first_event = True
+    extractor = FieldExtractor()
+    response_text = ""
+    # DeadlineMiddleware lets go once the response has started, so the stream enforces the deadline itself.
+    left = remaining()
+    expires = None if left is None else asyncio.get_running_loop().time() + left
+    with metrics.IN_FLIGHT.track_inprogress():
+        try:
+            async with asyncio.timeout_at(expires) as timeout:
+                async with admission.slot(), breaker.call():
+                    async for chunk in backend.generate_stream(
+                        prompt_text, image_bytes, symptoms, instruction=prompt.system, timeout=left
+                    ):
+                        response_text += chunk
+                        for field, value in extractor.feed(response_text):
+                            if first_event:
+                                metrics.STREAM_FIRST_EVENT.observe(time.perf_counter() - start)
+                                first_event = False
+                            # The timeout cancels this task, so it must not fire while the
+                            # caller is sending the event; it is re-armed, and fires at
+                            # once if already due, when the caller asks for more.
+                            timeout.reschedule(None)
+                            yield sse_event(field, value)
+                            timeout.reschedule(expires)
+        except (asyncio.CancelledError, GeneratorExit):
+            # The client went away mid-stream.
+            metrics.CANCELLED["disconnect"].inc()
+            raise
+        except TimeoutError:
+            metrics.CANCELLED["deadline"].inc()
+            logger.warning("model stream cut off at the request deadline", extra={"backend": backend.name})
+            yield sse_event("error", {"detail": "Request deadline passed before the model finished"})
+            return
+        except CircuitOpenError as circuit_open:
+            # The breaker opened while this request waited for an admission slot.
+            yield sse_event("done", degraded_response(circuit_open))
+            return
+        except Overloaded as overloaded:
+            # Only a queue timeout gets here; a full queue was rejected before the stream started.
+            overloaded_error(overloaded)
+            yield sse_event("error", {"detail": str(overloaded), "retry_after": int(ADMISSION_RETRY_AFTER)})
+            return
+        except Exception as e:
+            logger.error("model stream failed", extra={"backend": backend.name, "error": str(e)})
+            metrics.OUTCOMES["upstream_error"].inc()
+            yield sse_event("error", {"detail": f"Gemini API error: {e}"})
+            return
+        metrics.STAGES["model"].observe(time.perf_counter() - start)
+
+        with metrics.STAGES["parse"].time():
+            parsed_response = parse_gemini_response(response_text, sample_raw())
+
+        if parsed_response is None:
+            metrics.OUTCOMES["parse_failed"].inc()
+            metrics.PROMPT_RESULTS.labels(prompt.version, "parse_failed").inc()
+            yield sse_event("done", {"prediction": FALLBACK_PREDICTION, "prompt_version": prompt.version})
+            return
+
+        await remember_prediction(cache_key, parsed_response, symptoms, prompt.version, image_hashes)
+        metrics.OUTCOMES["parsed"].inc()
+        metrics.PROMPT_RESULTS.labels(prompt.version, "parsed").inc()
+        # Fields the extractor could not pick out (e.g. malformed but recoverable output).
+        for field in extractor.pending:
+            yield sse_event(field, parsed_response[field])
+        yield sse_event("done", {"prediction": parsed_response, "prompt_version": prompt.version})
+
+
+def cached_stream(prediction, prompt_version):
+    for field in STREAM_FIELDS:
+        yield sse_event(field, prediction[field])
+    yield sse_event("done", {"prediction": prediction, "prompt_version": prompt_version})
+
+
+# Streaming endpoint
+@app.post("/predict_stream", openapi_extra=json_upload_schema(PredictRequest))
+async def predict_stream(request: Request):
+    """
+    Same input as /predict_json, answered as a text/event-stream of fields as they are generated.
+    """
+    image_bytes, fields = await read_json_upload(request, PredictFields)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    digest = image_digest(image_bytes)
+    prompt = prompts.select(digest)
+    cache_key = make_cache_key(digest, fields.symptoms, prompt.version)
+    cached = await lookup_prediction(cache_key)
+    if cached is not None:
+        metrics.OUTCOMES["cached"].inc()
+        return StreamingResponse(cached_stream(cached, prompt.version), media_type="text/event-stream", headers=headers)
+
+    image_hashes = None
+    if near_duplicates is not None:
+        try:
+            image_hashes = await fingerprint(image_bytes)
+        except InvalidImageError as image_error:
+            metrics.OUTCOMES["invalid_image"].inc()
+            raise HTTPException(status_code=422, detail=str(image_error))
+        near = await find_near_duplicate(image_hashes, fields.symptoms, prompt.version)
+        if near is not None:
+            metrics.OUTCOMES["near_duplicate"].inc()
+            return StreamingResponse(cached_stream(near, prompt.version), media_type="text/event-stream", headers=headers)
+
+    try:
+        breaker.check()
+    except CircuitOpenError as circuit_open:
+        return StreamingResponse(
+            iter([sse_event("done", degraded_response(circuit_open))]), media_type="text/event-stream", headers=headers
+        )
+
+    # Normalize before the response starts so a bad image still gets a proper 422.
+    try:
+        image_bytes = await preprocess_image(image_bytes)
+    except InvalidImageError as image_error:
+        metrics.OUTCOMES["invalid_image"].inc()
+        raise HTTPException(status_code=422, detail=str(image_error))
+
+    try:
+        admission.check()
+    except Overloaded as overloaded:
+        raise overloaded_error(overloaded)
+
+    return StreamingResponse(
+        stream_prediction(prompt, image_bytes, fields.symptoms, cache_key, image_hashes),
+        media_type="text/event-stream",
+        headers=headers,
+    )
+
+
+# Binary upload endpoint
+@app.post("/predict")
+async def predict(request: Request, symptoms: str = ""):
+    """
+    Same response as /predict_json, but the image is sent as raw bytes instead of base64-in-JSON.
+
+    Accepts either multipart/form-data with an "image" file and a "symptoms" field,
+    or an application/octet-stream body with symptoms in the query string.
+    """
+    with metrics.IN_FLIGHT.track_inprogress():
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_UPLOAD_BYTES} bytes")
+
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/form-data"):
+            # The form is parsed in full before we read the image, so cap the raw
+            # body too; MULTIPART_OVERHEAD_BYTES leaves room for boundaries and fields.
+            request = limit_body(request, MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES)
+            async with request.form(max_files=1, max_fields=4) as form:
+                upload = form.get("image")
+                if upload is None or isinstance(upload, str):
+                    raise HTTPException(status_code=422, detail="Missing 'image' file field")
+                symptoms = form.get("symptoms") or symptoms
+                image_bytes = await read_limited(iter_upload(upload), MAX_UPLOAD_BYTES)
+        else:
+            image_bytes = await read_limited(request.stream(), MAX_UPLOAD_BYTES)
+
+        if not image_bytes:
+            raise HTTPException(status_code=422, detail="Empty image")
+
+        try:
+            body = await run_prediction(image_bytes, symptoms)
+        except HTTPException:
+            raise
+        except Exception as e:
+            metrics.OUTCOMES["error"].inc()
+            raise HTTPException(status_code=500, detail=str(e))
+        return render_json(body)
+
+
+# Jobs run through the same prediction path as the synchronous endpoints.
+job_queue = JobQueue(run_prediction, workers=JOB_WORKERS, max_queued=JOB_QUEUE_SIZE, ttl=JOB_RESULT_TTL)
+metrics.JOBS_QUEUED.set_function(lambda: job_queue.queue.qsize())
+
+
+@app.post("/jobs", status_code=202, openapi_extra=json_upload_schema(JobRequest))
+async def submit_job(request: Request):
+    """
+    Queue a prediction and return its job ID immediately; poll GET /jobs/{job_id} for the result.
+    """
+    image_bytes, fields = await read_json_upload(request, JobFields)
+    if fields.callback_url and not JOB_WEBHOOKS_ENABLED:
+        raise HTTPException(status_code=400, detail="Webhooks are not enabled on this server")
+
+    try:
+        job = job_queue.submit(image_bytes, fields.symptoms, fields.callback_url)
+    except QueueFullError:
+        metrics.JOBS_REJECTED.inc()
+        raise HTTPException(status_code=503, detail="Job queue is full", headers={"Retry-After": "5"})
+
+    return json_codec.ResponseClass(status_code=202, content=job.to_dict(), headers={"Location": f"/jobs/{job.id}"})
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.to_dict()
+
+
+def prediction_stats():
+    stats = prediction_cache.stats()
+    stats["in_flight"] = len(inflight_predictions)
+    stats["coalesced"] = inflight_predictions.coalesced
+    stats["abandoned"] = inflight_predictions.abandoned
+    near_duplicate_stats = near_duplicates.stats() if near_duplicates is not None else {}
+    for name in ("entries", "hits", "misses"):
+        stats[f"near_duplicate_{name}"] = near_duplicate_stats.get(name, 0)
+    store_stats = prediction_store.stats() if prediction_store is not None else {}
+    for name in ("hits", "misses", "writes", "bytes_written", "file_bytes", "compactions"):
+        stats[f"store_{name}"] = store_stats.get(name, 0)
+    stats["log_records_dropped"] = dropped_records()
+    return stats
+
+
+metrics.register_stats(prediction_stats)
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness: the process is up and serving.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: the backend has started (and warmed up, if enabled) and can take traffic.
+    """
+    if backend_status["ready"]:
+        return {"status": "ready", "backend": backend.name}
+    status = "failed" if backend_status["error"] else "starting"
+    return json_codec.ResponseClass(
+        status_code=503, content={"status": status, "backend": backend.name, "error": backend_status["error"]}
+    )
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return prediction_stats()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
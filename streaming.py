@@ -0,0 +1,38 @@
+import json
+import re
+
+# Prediction fields streamed to the client as soon as each one is complete.
+STREAM_FIELDS = ("top_3_possible_diseases", "explanation", "urgency", "recommended_next_steps")
+
+
+class FieldExtractor:
+    """
+    Pulls complete top-level field values out of a partially generated JSON object.
+
+    Each call to feed() gets the text generated so far and returns the fields
+    whose values became complete since the last call, in the order they appear
+    in the text. A value counts as complete once it decodes on its own, so a
+    string waits for its closing quote and a list for its closing bracket.
+    """
+
+    def __init__(self, fields=STREAM_FIELDS):
+        self.pending = {field: re.compile(r'"%s"\s*:\s*' % re.escape(field)) for field in fields}
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        found = []
+        for field, pattern in list(self.pending.items()):
+            match = pattern.search(text)
+            if match is None:
+                continue
+            try:
+                value, _ = self.decoder.raw_decode(text, match.end())
+            except json.JSONDecodeError:
+                continue
+            del self.pending[field]
+            found.append((match.start(), field, value))
+        return [(field, value) for _, field, value in sorted(found)]
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
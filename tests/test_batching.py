@@ -0,0 +1,129 @@
+import asyncio
+
+from batching import MicroBatcher
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_calls_in_one_window_share_a_batch():
+    batches = []
+    observed = []
+
+    async def run_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.01, max_size=8, on_batch=lambda size, delays: observed.append(size))
+        return await asyncio.gather(*(batcher.submit(i) for i in range(5)))
+
+    assert run(main()) == [0, 10, 20, 30, 40]
+    assert batches == [[0, 1, 2, 3, 4]]
+    assert observed == [5]
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    batches = []
+
+    async def run_batch(items):
+        batches.append(list(items))
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=10, max_size=3)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(6))), 1)
+
+    assert run(main()) == list(range(6))
+    assert batches == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_exception_result_goes_to_its_caller_only():
+    async def run_batch(items):
+        return [ValueError(f"bad {item}") if item == 1 else item for item in items]
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.01)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    first, second, third = run(main())
+    assert (first, third) == (0, 2)
+    assert isinstance(second, ValueError) and str(second) == "bad 1"
+
+
+def test_batch_failure_goes_to_every_caller():
+    async def run_batch(items):
+        raise RuntimeError("upstream down")
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.01)
+        return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in run(main()))
+
+
+def test_caller_cancelled_before_flush_is_left_out():
+    batches = []
+
+    async def run_batch(items):
+        batches.append(list(items))
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.05)
+        gone = asyncio.create_task(batcher.submit("gone"))
+        kept = asyncio.create_task(batcher.submit("kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        return await kept
+
+    assert run(main()) == "kept"
+    assert batches == [["kept"]]
+
+
+def test_batch_is_cancelled_once_every_caller_gives_up():
+    started = asyncio.Event()
+    state = {}
+
+    async def run_batch(items):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.01)
+        callers = [asyncio.create_task(batcher.submit(i)) for i in range(2)]
+        await started.wait()
+        callers[0].cancel()
+        await asyncio.sleep(0.01)
+        assert "cancelled" not in state
+        callers[1].cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert not batcher._tasks
+
+    run(main())
+    assert state["cancelled"]
+
+
+def test_one_caller_giving_up_does_not_affect_the_rest():
+    async def run_batch(items):
+        await asyncio.sleep(0.02)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(run_batch, window=0.01)
+        callers = [asyncio.create_task(batcher.submit(i)) for i in range(3)]
+        await asyncio.sleep(0.015)
+        callers[1].cancel()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert isinstance(results[1], asyncio.CancelledError)
+        return results[0], results[2]
+
+    assert run(main()) == (0, 2)
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def fail(breaker, exc):
+    with pytest.raises(type(exc)):
+        async with breaker.call():
+            raise exc
+
+
+async def succeed(breaker):
+    async with breaker.call():
+        pass
+
+
+def open_breaker(**kwargs):
+    # open_seconds=0 makes the breaker half-open as soon as its state is read.
+    breaker = CircuitBreaker(window=2, min_calls=2, open_seconds=0, **kwargs)
+
+    async def trip():
+        await fail(breaker, RuntimeError("upstream down"))
+        await fail(breaker, RuntimeError("upstream down"))
+
+    run(trip())
+    return breaker
+
+
+def test_failures_open_the_breaker():
+    states = []
+    breaker = CircuitBreaker(window=2, min_calls=2, open_seconds=60, on_state_change=states.append)
+
+    async def main():
+        await fail(breaker, RuntimeError("upstream down"))
+        assert breaker.state == CLOSED
+        await fail(breaker, RuntimeError("upstream down"))
+
+    run(main())
+    assert states == [OPEN]
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_healthy_probe_closes_the_breaker():
+    breaker = open_breaker()
+    assert breaker.state == HALF_OPEN
+    run(succeed(breaker))
+    assert breaker.state == CLOSED
+
+
+def test_probe_slot_is_held_while_the_probe_runs():
+    breaker = open_breaker()
+
+    async def main():
+        async with breaker.call():
+            with pytest.raises(CircuitOpenError):
+                breaker.check()
+
+    run(main())
+
+
+def test_probe_that_is_not_a_failure_gives_its_slot_back():
+    breaker = open_breaker(is_failure=lambda e: not isinstance(e, ValueError))
+
+    async def main():
+        await fail(breaker, ValueError("invalid image"))
+        assert breaker.state == HALF_OPEN
+        # The slot is free again, so the next call is let through as a probe.
+        breaker.check()
+        await succeed(breaker)
+
+    run(main())
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_gives_its_slot_back():
+    breaker = open_breaker()
+
+    async def probe(started):
+        async with breaker.call():
+            started.set()
+            await asyncio.sleep(10)
+
+    async def main():
+        started = asyncio.Event()
+        task = asyncio.create_task(probe(started))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.state == HALF_OPEN
+        breaker.check()
+
+    run(main())
+
+
+def test_failed_probe_reopens_the_breaker():
+    states = []
+    breaker = open_breaker(on_state_change=states.append)
+    assert breaker.state == HALF_OPEN
+    breaker.open_seconds = 60
+    run(fail(breaker, RuntimeError("still down")))
+    assert breaker.state == OPEN
+    assert states == [OPEN, HALF_OPEN, OPEN]
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import time
+
+from deadlines import DeadlineMiddleware, deadline_var, remaining, request_timeout
+
+
+def http_scope(timeout=None):
+    headers = [(b"x-request-timeout", str(timeout).encode())] if timeout is not None else []
+    return {"type": "http", "method": "POST", "path": "/", "headers": headers}
+
+
+def make_receive(disconnect_after=None):
+    """
+    The request body, then nothing until an http.disconnect disconnect_after seconds later, if ever.
+    """
+    messages = [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+def call(app, scope, receive=None, **kwargs):
+    """
+    Run the middleware around app and return (messages sent, cancel reasons, whether the task is left cancelled).
+    """
+    sent = []
+    reasons = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def main():
+        middleware = DeadlineMiddleware(app, on_cancel=reasons.append, **kwargs)
+        await middleware(scope, receive or make_receive(), send)
+        # The middleware must leave the task usable after cancelling the handler.
+        await asyncio.sleep(0)
+        return asyncio.current_task().cancelling()
+
+    cancelling = asyncio.run(main())
+    return sent, reasons, cancelling
+
+
+async def read_body(receive):
+    message = await receive()
+    assert message["type"] == "http.request"
+
+
+def test_deadline_before_response_answers_504():
+    async def slow_app(scope, receive, send):
+        await read_body(receive)
+        await asyncio.sleep(5)
+
+    start = time.monotonic()
+    sent, reasons, cancelling = call(slow_app, http_scope(0.05))
+    assert time.monotonic() - start < 1
+    assert reasons == ["deadline"]
+    assert cancelling == 0
+    assert sent[0]["status"] == 504
+    assert json.loads(sent[1]["body"]) == {"detail": "Request did not finish within 0.05s"}
+
+
+def test_no_cancellation_once_the_response_has_started():
+    async def streaming_app(scope, receive, send):
+        await read_body(receive)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await asyncio.sleep(0.1)
+        await send({"type": "http.response.body", "body": b"late but whole"})
+
+    sent, reasons, _ = call(streaming_app, http_scope(0.02))
+    assert reasons == []
+    assert [message.get("status") for message in sent] == [200, None]
+    assert sent[1]["body"] == b"late but whole"
+
+
+def test_client_disconnect_cancels_without_a_response():
+    cancelled = []
+
+    async def slow_app(scope, receive, send):
+        await read_body(receive)
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    sent, reasons, cancelling = call(slow_app, http_scope(), make_receive(disconnect_after=0.02))
+    assert reasons == ["disconnect"]
+    assert cancelled == [True]
+    assert sent == []
+    assert cancelling == 0
+
+
+def test_fast_app_is_untouched_and_sees_its_deadline():
+    seen = []
+
+    async def app(scope, receive, send):
+        await read_body(receive)
+        seen.append(remaining())
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    sent, reasons, _ = call(app, http_scope(2))
+    assert reasons == []
+    assert sent[0]["status"] == 200
+    assert 1.5 < seen[0] <= 2
+    assert deadline_var.get() is None
+
+
+def test_request_timeout_header():
+    assert request_timeout(http_scope(5), default=85, maximum=120) == 5
+    assert request_timeout(http_scope(500), default=85, maximum=120) == 120
+    assert request_timeout(http_scope(), default=85, maximum=120) == 85
+    assert request_timeout(http_scope("soon"), default=85, maximum=120) == 85
+    assert request_timeout(http_scope(-1), default=85, maximum=120) == 85
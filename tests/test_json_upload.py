@@ -0,0 +1,122 @@
+import base64
+import json
+import random
+
+import pytest
+
+from json_upload import InvalidBodyError, JsonImageParser, PayloadTooLarge
+
+
+def parse(body, chunk_sizes=None, **kwargs):
+    parser = JsonImageParser(**kwargs)
+    i = 0
+    while i < len(body):
+        size = len(body) - i if chunk_sizes is None else next(chunk_sizes)
+        parser.feed(body[i:i + size])
+        i += size
+    return parser.finish()
+
+
+def random_chunks(rng):
+    while True:
+        yield rng.choice((1, 1, 2, 3, 5, 7, 64, 1000))
+
+
+def random_text(rng):
+    alphabet = 'abc XYZ"\\/\b\f\n\r\t\x00\x1f' + "é€😀"
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 12)))
+
+
+def random_value(rng, depth=0):
+    kind = rng.randrange(7 if depth < 2 else 5)
+    if kind == 0:
+        return random_text(rng)
+    if kind == 1:
+        return rng.randint(-10 ** 6, 10 ** 6)
+    if kind == 2:
+        return rng.uniform(-1e3, 1e3)
+    if kind == 3:
+        return rng.choice((True, False, None))
+    if kind == 4:
+        return ""
+    if kind == 5:
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))]
+    return {random_text(rng): random_value(rng, depth + 1) for _ in range(rng.randint(0, 3))}
+
+
+def random_body(rng):
+    """
+    A JSON body with an image field and other fields in random order and encodings, and what it should parse to.
+    """
+    image = rng.randbytes(rng.randint(0, 300))
+    encoded = base64.b64encode(image).decode()
+    if rng.random() < 0.3:
+        encoded = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+    fields = {f"f{i}{random_text(rng)}": random_value(rng) for i in range(rng.randint(0, 4))}
+    fields.pop("image_base64", None)
+    items = list(fields.items()) + [("image_base64", encoded)]
+    rng.shuffle(items)
+    ensure_ascii = rng.random() < 0.5
+    parts = []
+    for key, value in items:
+        text = json.dumps(value, ensure_ascii=ensure_ascii)
+        if key == "image_base64" and rng.random() < 0.5:
+            # Some encoders escape every slash.
+            text = text.replace("/", "\\/")
+        parts.append(json.dumps(key, ensure_ascii=ensure_ascii) + rng.choice((":", " : ", ":\n")) + text)
+    body = "{" + rng.choice((",", ", ", ",\n  ")).join(parts) + "}"
+    return body.encode(), image, json.loads(body)
+
+
+def test_matches_json_loads_under_random_chunking():
+    rng = random.Random(1234)
+    for _ in range(500):
+        body, image, expected = random_body(rng)
+        del expected["image_base64"]
+        parsed_image, fields = parse(body, random_chunks(rng))
+        assert parsed_image == image
+        assert json.dumps(fields, sort_keys=True) == json.dumps(expected, sort_keys=True)
+
+
+def test_escape_split_across_chunks():
+    body = b'{"symptoms": "caf\\u00e9 \\"itchy\\"", "image_base64": "aGk\\/"}'
+    for split in range(1, len(body)):
+        image, fields = parse(body, iter([split, len(body)]))
+        assert image == base64.b64decode("aGk/")
+        assert fields == {"symptoms": 'café "itchy"'}
+
+
+def test_missing_image_returns_none():
+    assert parse(b'{"symptoms": "itchy"}') == (None, {"symptoms": "itchy"})
+
+
+def test_image_over_limit_is_payload_too_large():
+    body = json.dumps({"image_base64": base64.b64encode(b"x" * 1000).decode()}).encode()
+    with pytest.raises(PayloadTooLarge):
+        parse(body, max_image_bytes=999)
+    assert parse(body, max_image_bytes=1000)[0] == b"x" * 1000
+
+
+def test_field_over_limit_is_payload_too_large():
+    with pytest.raises(PayloadTooLarge):
+        parse(json.dumps({"symptoms": "a" * 100}).encode(), max_field_bytes=50)
+    with pytest.raises(PayloadTooLarge):
+        parse(json.dumps({"extra": list(range(100))}).encode(), max_field_bytes=50)
+
+
+@pytest.mark.parametrize("body", [
+    b"",
+    b"[]",
+    b'{"image_base64": "aGk="',
+    b'{"image_base64": "aGk="} trailing',
+    b'{"image_base64" "aGk="}',
+    b'{"image_base64": "aGk"}',
+    b'{"image_base64": "aGk\\q="}',
+    b'{"image_base64": "aGk\\ud83d="}',
+    b'{"symptoms": tru}',
+    b'{"symptoms": "\\x"}',
+    b'{"a": 1,}',
+])
+def test_malformed_body_is_invalid(body):
+    with pytest.raises(InvalidBodyError):
+        parse(body)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from backends import UpstreamError
+from retry import DeadlineExceeded, RetryPolicy
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_retryable_error_is_retried():
+    calls = []
+    events = []
+
+    async def fn(timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            raise UpstreamError("connection reset")
+        return "ok"
+
+    policy = RetryPolicy(attempts=3, base_delay=0, on_event=events.append)
+    assert run(policy.run(fn)) == "ok"
+    assert len(calls) == 2
+    assert events == ["retry"]
+
+
+def test_non_retryable_error_is_raised_at_once():
+    calls = []
+
+    async def fn(timeout):
+        calls.append(timeout)
+        raise UpstreamError("bad request", 400)
+
+    with pytest.raises(UpstreamError):
+        run(RetryPolicy(attempts=3, base_delay=0).run(fn))
+    assert len(calls) == 1
+
+
+def test_hedge_wins_and_slow_attempt_is_cancelled():
+    events = []
+    cancelled = []
+    calls = 0
+
+    async def fn(timeout):
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("first")
+                raise
+        return f"attempt {calls}"
+
+    policy = RetryPolicy(hedge=True, hedge_after=0.02, on_event=events.append)
+    assert run(asyncio.wait_for(policy.run(fn), 1)) == "attempt 2"
+    assert events == ["hedge", "hedge_won"]
+    assert cancelled == ["first"]
+
+
+def test_first_attempt_wins_and_hedge_is_cancelled():
+    events = []
+    cancelled = []
+    calls = 0
+
+    async def fn(timeout):
+        nonlocal calls
+        calls += 1
+        attempt = calls
+        try:
+            await asyncio.sleep(0.05 if attempt == 1 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(attempt)
+            raise
+        return f"attempt {attempt}"
+
+    async def main():
+        result = await asyncio.wait_for(RetryPolicy(hedge=True, hedge_after=0.01, on_event=events.append).run(fn), 1)
+        # Let the cancelled hedge unwind.
+        await asyncio.sleep(0)
+        return result
+
+    assert run(main()) == "attempt 1"
+    assert events == ["hedge"]
+    assert cancelled == [2]
+
+
+def test_deadline_becomes_deadline_exceeded():
+    calls = []
+
+    async def fn(timeout):
+        calls.append(timeout)
+        await asyncio.wait_for(asyncio.sleep(10), timeout)
+
+    async def main():
+        return await RetryPolicy(attempts=3, base_delay=0).run(fn, deadline=time.monotonic() + 0.05)
+
+    with pytest.raises(DeadlineExceeded) as excinfo:
+        run(asyncio.wait_for(main(), 1))
+    assert isinstance(excinfo.value.__cause__, TimeoutError)
+    assert len(calls) == 1 and calls[0] <= 0.05
+
+
+def test_expired_deadline_skips_the_call():
+    calls = []
+
+    async def fn(timeout):
+        calls.append(timeout)
+
+    with pytest.raises(DeadlineExceeded):
+        run(RetryPolicy().run(fn, deadline=time.monotonic() - 1))
+    assert calls == []
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_callers_share_one_call():
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "prediction"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fn) for _ in range(3)))
+        return flight, results
+
+    flight, results = run(main())
+    assert results == ["prediction"] * 3
+    assert calls == 1
+    assert flight.coalesced == 2
+    assert len(flight) == 0
+
+
+def test_error_goes_to_every_waiter_and_next_call_starts_fresh():
+    calls = 0
+
+    async def fn():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            raise RuntimeError("upstream down")
+        return "prediction"
+
+    async def main():
+        flight = SingleFlight()
+        errors = await asyncio.gather(flight.do("key", fn), flight.do("key", fn), return_exceptions=True)
+        return errors, await flight.do("key", fn)
+
+    errors, result = run(main())
+    assert [str(error) for error in errors] == ["upstream down", "upstream down"]
+    assert result == "prediction"
+    assert calls == 2
+
+
+def test_call_survives_while_a_waiter_remains():
+    cancelled = []
+
+    async def fn():
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        return "prediction"
+
+    async def main():
+        flight = SingleFlight()
+        leaving = asyncio.create_task(flight.do("key", fn))
+        staying = asyncio.create_task(flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return flight, await staying
+
+    flight, result = run(main())
+    assert result == "prediction"
+    assert cancelled == []
+    assert flight.abandoned == 0
+
+
+def test_call_is_cancelled_when_its_last_waiter_leaves():
+    cancelled = []
+
+    async def fn():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        flight = SingleFlight()
+        waiters = [asyncio.create_task(flight.do("key", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        # Let the shared call unwind and its done callback run.
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        # Checked before asyncio.run() cancels whatever is left on the way out.
+        assert cancelled == [True]
+        return flight
+
+    flight = run(main())
+    assert flight.abandoned == 1
+    assert len(flight) == 0